@@ -0,0 +1,327 @@
+"""Load test: drive the bot's router with synthetic updates against generated catalogues.
+
+Nothing goes to the network: the Bot uses an in-process session that answers
+every API call. For each catalogue size the handlers are exercised one after
+another and p50/p95/p99 latency plus throughput are reported per handler.
+
+    python bench/run.py --sizes 1000,100000 --iterations 300 --concurrency 16
+    python bench/run.py --sizes 1000 --compare bench/results/<previous>.json
+
+Generated catalogues are cached in bench/data/ (built from db/init.sql, like
+db/seed.py); every run works on a copy so the CSV import phase can write.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT, "bench", "data")
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+INIT_SQL = os.path.join(ROOT, "db", "init.sql")
+
+HANDLERS = ("cmd_search", "on_location", "on_category", "cmd_random", "inline_query_handler", "on_csv_upload")
+CATEGORIES = ["Питание", "Достопримечательности", "Музеи", "События", "Парки", "Спортзалы"]
+WORDS = ["Batumi", "Kobuleti", "Sea", "Garden", "Fortress", "Plaza", "Boulevard", "Tower", "Market", "Harbor",
+         "Кафе", "Хинкальная", "Парк", "Музей", "Крепость", "Набережная", "Театр", "Рынок", "Пляж", "Сад"]
+CSV_HEADER = "city,name,category,lat,lon,description,address,hours,rating,url,kids_friendly,dog_friendly,price_level\n"
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "GuideBot"}
+
+
+def cities_for(n_places: int) -> int:
+    return max(10, n_places // 2000)
+
+
+def city_name(i: int) -> str:
+    # users who never ran /city get the bot's DEFAULT_CITY, so it has to exist
+    return os.getenv("DEFAULT_CITY", "Batumi") if i == 0 else f"City{i:04d}"
+
+
+def city_centers(n_cities: int, seed: int = 7):
+    rng = random.Random(seed)
+    return [(rng.uniform(40.0, 44.0), rng.uniform(39.0, 46.0)) for _ in range(n_cities)]
+
+
+def build_catalogue(path: str, n_places: int, seed: int = 1):
+    n_cities = cities_for(n_places)
+    rng = random.Random(seed)
+    centers = city_centers(n_cities)
+    conn = sqlite3.connect(path)
+    with open(INIT_SQL, encoding="utf-8") as f:
+        conn.executescript(f.read())
+    conn.executemany("INSERT INTO cities(name) VALUES(?)", [(city_name(i),) for i in range(n_cities)])
+
+    def rows():
+        for i in range(n_places):
+            c = i % n_cities
+            lat0, lon0 = centers[c]
+            name = f"{rng.choice(WORDS)} {rng.choice(WORDS)} {i}"
+            yield (c + 1, name, rng.choice(CATEGORIES), lat0 + rng.gauss(0, 0.03), lon0 + rng.gauss(0, 0.03),
+                   f"{rng.choice(WORDS)} {rng.choice(WORDS)} {rng.choice(WORDS)}", f"{rng.choice(WORDS)} St {i % 300}",
+                   "10:00–22:00", round(rng.uniform(3.0, 5.0), 1), "", rng.randint(0, 1), rng.randint(0, 1), rng.randint(0, 4))
+
+    conn.executemany("""
+        INSERT INTO places(city_id, name, category, lat, lon, description, address, hours, rating, url, kids_friendly, dog_friendly, price_level)
+        VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?)
+    """, rows())
+    # a fifth of users run with filters on
+    conn.executemany("INSERT INTO user_prefs(user_id, kids_friendly, price_level) VALUES(?, 1, ?)",
+                     [(uid, rng.randint(0, 4)) for uid in range(1, 5001, 5)])
+    conn.commit()
+    conn.close()
+
+
+def catalogue_path(n_places: int) -> str:
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, f"catalogue_{city_name(0)}_{n_places}.db")
+    if not os.path.exists(path):
+        started = time.perf_counter()
+        build_catalogue(path + ".tmp", n_places)
+        os.replace(path + ".tmp", path)
+        print(f"built {path} in {time.perf_counter() - started:.1f}s")
+    return path
+
+
+# --- synthetic updates ---
+class Updates:
+    def __init__(self, n_places: int, seed: int = 3):
+        self.rng = random.Random(seed)
+        self.n_cities = cities_for(n_places)
+        self.centers = city_centers(self.n_cities)
+        self.next_id = 0
+
+    def _id(self) -> int:
+        self.next_id += 1
+        return self.next_id
+
+    def _user(self):
+        uid = self.rng.randint(1, 5000)
+        return {"id": uid, "is_bot": False, "first_name": f"u{uid}"}, {"id": uid, "type": "private"}
+
+    def _city(self) -> str:
+        return city_name(self.rng.randrange(self.n_cities))
+
+    def _message(self, **fields):
+        user, chat = self._user()
+        return {"update_id": self._id(), "message": {"message_id": self._id(), "date": int(time.time()),
+                                                      "chat": chat, "from": user, **fields}}
+
+    def _query(self) -> str:
+        word = self.rng.choice(WORDS).lower()
+        return word[:self.rng.randint(2, len(word))]
+
+    def cmd_search(self):
+        text = f"/search {self._query()}"
+        return self._message(text=text, entities=[{"type": "bot_command", "offset": 0, "length": 7}])
+
+    def cmd_random(self):
+        return self._message(text="/random", entities=[{"type": "bot_command", "offset": 0, "length": 7}])
+
+    def on_location(self):
+        lat0, lon0 = self.centers[self.rng.randrange(self.n_cities)]
+        return self._message(location={"latitude": lat0 + self.rng.gauss(0, 0.02),
+                                       "longitude": lon0 + self.rng.gauss(0, 0.02)})
+
+    def on_category(self):
+        user, chat = self._user()
+        return {"update_id": self._id(), "callback_query": {
+            "id": str(self._id()), "from": user, "chat_instance": "x",
+            "data": f"cat:{self._city()}:{self.rng.choice(CATEGORIES)}",
+            "message": {"message_id": 1, "date": int(time.time()), "chat": chat, "from": BOT_USER, "text": "x"}}}
+
+    def inline_query_handler(self):
+        user, _ = self._user()
+        query = self._query() if self.rng.random() < 0.9 else ""
+        return {"update_id": self._id(), "inline_query": {"id": str(self._id()), "from": user, "query": query, "offset": ""}}
+
+    def on_csv_upload(self):
+        return self._message(document={"file_id": "bench", "file_unique_id": "bench", "mime_type": "text/csv"})
+
+    def csv_bytes(self, rows: int) -> bytes:
+        lines = [CSV_HEADER]
+        for i in range(rows):
+            lat0, lon0 = self.centers[self.rng.randrange(self.n_cities)]
+            lines.append(f"{self._city()},Bench Place {self.rng.randrange(10 * rows)},{self.rng.choice(CATEGORIES)},"
+                         f"{lat0:.5f},{lon0:.5f},bench row,Bench St,24/7,4.0,,1,0,2\n")
+        return "".join(lines).encode()
+
+
+def make_session(csv_payload: Dict[str, bytes]):
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import EditMessageText, GetFile, SendMessage
+    from aiogram.types import File, Message
+
+    class BenchSession(BaseSession):
+        """Answers every Bot API call in-process."""
+
+        async def make_request(self, bot, method, timeout=None):
+            if isinstance(method, GetFile):
+                return File(file_id="bench", file_unique_id="bench", file_path="bench.csv")
+            if isinstance(method, (SendMessage, EditMessageText)):
+                chat_id = method.chat_id or 0
+                return Message(message_id=1, date=int(time.time()), chat={"id": chat_id, "type": "private"},
+                               text=method.text).as_(bot)
+            return True
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            yield csv_payload["data"]
+
+        async def close(self):
+            pass
+
+    return BenchSession()
+
+
+def summarize(latencies: List[float], errors: int, wall: float) -> dict:
+    ms = sorted(x * 1000 for x in latencies)
+    if len(ms) >= 2:
+        q = statistics.quantiles(ms, n=100, method="inclusive")
+        p50, p95, p99 = q[49], q[94], q[98]
+    else:
+        p50 = p95 = p99 = ms[0] if ms else 0.0
+    return {"count": len(ms), "errors": errors, "p50_ms": round(p50, 3), "p95_ms": round(p95, 3),
+            "p99_ms": round(p99, 3), "mean_ms": round(statistics.fmean(ms), 3) if ms else 0.0,
+            "throughput_rps": round(len(ms) / wall, 1) if wall else 0.0}
+
+
+async def run_size(n_places: int, args) -> dict:
+    work = os.path.join(DATA_DIR, f"run_{n_places}.db")
+    shutil.copyfile(catalogue_path(n_places), work)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(work + suffix):
+            os.remove(work + suffix)
+    os.environ["DB_PATH"] = work
+
+    import bot as guide  # DB_PATH is read at import time
+    from aiogram import Bot
+    from aiogram.types import Update
+
+    updates = Updates(n_places)
+    csv_payload = {"data": updates.csv_bytes(args.csv_rows)}
+    bot = Bot("123456:BENCH", session=make_session(csv_payload))
+    dp = guide.create_dispatcher()
+    started = time.perf_counter()
+    await guide.on_startup()
+    startup_s = time.perf_counter() - started
+    # measure steady state: let the background warmup finish first
+    await guide.warmup_task
+    ready_s = time.perf_counter() - started
+    print(f"  serving after {startup_s:.2f}s, warm after {ready_s:.2f}s")
+
+    results = {}
+    for name in args.handlers:
+        make = getattr(updates, name)
+        count = args.csv_iterations if name == "on_csv_upload" else args.iterations
+        for _ in range(0 if name == "on_csv_upload" else args.warmup):
+            await dp.feed_update(bot, Update.model_validate(make(), context={"bot": bot}))
+        latencies: List[float] = []
+        errors = 0
+        sem = asyncio.Semaphore(1 if name == "on_csv_upload" else args.concurrency)
+
+        async def one(update):
+            nonlocal errors
+            async with sem:
+                t0 = time.perf_counter()
+                try:
+                    await dp.feed_update(bot, update)
+                except Exception as e:
+                    errors += 1
+                    if errors == 1:
+                        print(f"  {name}: {type(e).__name__}: {e}")
+                latencies.append(time.perf_counter() - t0)
+
+        batch = [Update.model_validate(make(), context={"bot": bot}) for _ in range(count)]
+        wall_start = time.perf_counter()
+        await asyncio.gather(*(one(u) for u in batch))
+        results[name] = summarize(latencies, errors, time.perf_counter() - wall_start)
+        r = results[name]
+        print(f"  {name:<22} p50 {r['p50_ms']:>8.2f}ms  p95 {r['p95_ms']:>8.2f}ms  p99 {r['p99_ms']:>8.2f}ms"
+              f"  {r['throughput_rps']:>8.1f}/s  errors {r['errors']}")
+
+    await guide.on_shutdown()
+    sys.modules.pop("bot", None)
+    os.remove(work)
+    return {"places": n_places, "cities": cities_for(n_places), "startup_s": round(startup_s, 3),
+            "ready_s": round(ready_s, 3), "handlers": results}
+
+
+def compare(current: dict, previous_path: str, threshold: float) -> bool:
+    with open(previous_path, encoding="utf-8") as f:
+        previous = json.load(f)
+    ok = True
+    print(f"\ncompared with {previous_path} (p95, regression threshold {threshold:.0f}%)")
+    for size, run in current["runs"].items():
+        old_run = previous.get("runs", {}).get(size)
+        if not old_run:
+            continue
+        for name, r in run["handlers"].items():
+            old = old_run["handlers"].get(name)
+            if not old or not old["p95_ms"]:
+                continue
+            delta = (r["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100
+            flag = "REGRESSION" if delta > threshold else ""
+            ok = ok and not flag
+            print(f"  {size:>8} {name:<22} {old['p95_ms']:>8.2f} -> {r['p95_ms']:>8.2f}ms  {delta:+6.1f}% {flag}")
+    return ok
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,100000", help="comma-separated catalogue sizes, e.g. 1000,100000,1000000")
+    parser.add_argument("--handlers", default=",".join(HANDLERS))
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--csv-iterations", type=int, default=3)
+    parser.add_argument("--csv-rows", type=int, default=2000)
+    parser.add_argument("--out", default="", help="result JSON path (default: bench/results/<timestamp>.json)")
+    parser.add_argument("--compare", default="", help="previous result JSON to compare p95 against")
+    parser.add_argument("--threshold", type=float, default=20.0, help="p95 regression %% that fails --compare")
+    args = parser.parse_args()
+    args.handlers = [h for h in args.handlers.split(",") if h]
+    unknown = set(args.handlers) - set(HANDLERS)
+    if unknown:
+        parser.error(f"unknown handlers: {', '.join(sorted(unknown))}")
+
+    sys.path.insert(0, ROOT)
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+    report = {"meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": git_commit(),
+                       "python": platform.python_version(), "iterations": args.iterations,
+                       "concurrency": args.concurrency, "csv_rows": args.csv_rows},
+              "runs": {}}
+    for size in (int(s) for s in args.sizes.split(",") if s):
+        print(f"catalogue of {size} places")
+        report["runs"][str(size)] = await run_size(size, args)
+
+    out = args.out or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"results written to {out}")
+    if args.compare and not compare(report, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,11 +1,21 @@
+import time
+
+STARTED = time.perf_counter()  # before the imports below, for the startup breakdown
+
 import asyncio
+import json
 import logging
+import math
+import multiprocessing
 import os
-import csv
+import shutil
+import signal
+import tempfile
 from typing import Optional, List, Tuple
 
-import aiosqlite
 from aiogram import Bot, Dispatcher, F, Router
+from aiogram.client.default import DefaultBotProperties
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command, CommandObject, CommandStart
 from aiogram.types import (Message, CallbackQuery, InlineKeyboardMarkup, KeyboardButton,
                            ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineQuery, InlineQueryResultArticle, InputTextMessageContent,
@@ -14,15 +24,83 @@ from aiogram.types import (Message, CallbackQuery, InlineKeyboardMarkup, Keyboar
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from dotenv import load_dotenv
 
-from utils.haversine import haversine_km
+from utils.cards import CardRenderer
+from utils.catalogue import CatalogueVersion
+from utils.csv_import import import_csv
+from utils.db_pool import DBPool
+from utils.favorites import FavoritesStore
+from utils.geo import SORT_MODES, GeoIndex, NearbyBatcher
+from utils.i18n import Bundles
+from utils.latest import LatestOnly
+from utils.limiter import ConcurrencyLimiter, InboundThrottle
+from utils.metrics import HandlerMetrics, LoopLagMonitor, QueryTimer, Registry, Startup, ready_handler, start_metrics_server
+from utils.migrations import Optimizer, migrate
+from utils.outbound import SendThrottle
+from utils.prefs import DEFAULT_PREFS, PrefsStore
+from utils.random_index import RandomIndex
+from utils.result_cache import CachedResult, ResultCache
+from utils.search import CITY_MATCH, RANK_EXPR, fts_query, normalize_query
+from utils.sessions import SessionStore
+from utils.sharding import ShardRouter
+from utils.snapshot import Snapshots
+from utils.spatial import bounding_box, nearest
 
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 ADMIN_USER_ID = int(os.getenv("ADMIN_USER_ID", "0"))
 DEFAULT_CITY = os.getenv("DEFAULT_CITY", "Batumi")
-DB_PATH = os.path.join(os.path.dirname(__file__), "db", "guide.db")
+DB_PATH = os.getenv("DB_PATH") or os.path.join(os.path.dirname(__file__), "db", "guide.db")
 I18N_DIR = os.path.join(os.path.dirname(__file__), "i18n")
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+PREFS_CACHE_SIZE = int(os.getenv("PREFS_CACHE_SIZE", "10000"))
+PREFS_CACHE_TTL = float(os.getenv("PREFS_CACHE_TTL", "600"))
+PREFS_FLUSH_MS = int(os.getenv("PREFS_FLUSH_MS", "500"))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "50000"))
+SESSION_FLUSH_MS = int(os.getenv("SESSION_FLUSH_MS", "500"))
+FAV_CACHE_SIZE = int(os.getenv("FAV_CACHE_SIZE", "20000"))
+FAV_FLUSH_MS = int(os.getenv("FAV_FLUSH_MS", "500"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "2048"))
+RESULT_CACHE_DEPTH = int(os.getenv("RESULT_CACHE_DEPTH", "100"))  # rows kept per cached list
+PAGE_SIZE = 10
+INLINE_PAGE_SIZE = 20
+INLINE_CACHE_SIZE = int(os.getenv("INLINE_CACHE_SIZE", "4096"))
+INLINE_CACHE_TTL = float(os.getenv("INLINE_CACHE_TTL", "60"))
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "1"))  # seconds Telegram may reuse a personal answer
+INLINE_DEBOUNCE_MS = int(os.getenv("INLINE_DEBOUNCE_MS", "150"))
+CARD_CACHE_SIZE = int(os.getenv("CARD_CACHE_SIZE", "20000"))
+NEARBY_RADIUS_KM = float(os.getenv("NEARBY_RADIUS_KM", "3"))
+NEARBY_MAX_RADIUS_KM = float(os.getenv("NEARBY_MAX_RADIUS_KM", "25"))  # radius doubles up to this until enough places
+NEARBY_SORT = os.getenv("NEARBY_SORT", "distance")  # distance | rating | blend
+NEARBY_RATING_WEIGHT = float(os.getenv("NEARBY_RATING_WEIGHT", "0.5"))  # rating's share of the blend score
+NEARBY_LIMIT = 10
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 = no /metrics endpoint
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))  # 0 = slow query log off
+OPTIMIZE_INTERVAL_H = float(os.getenv("OPTIMIZE_INTERVAL_H", "6"))  # hours between PRAGMA optimize runs
+WARMUP_CITIES = int(os.getenv("WARMUP_CITIES", "20"))  # cities whose top rated and category lists are preloaded
+BOT_MODE = os.getenv("BOT_MODE", "polling")  # polling | webhook
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")  # self-hosted or fake Bot API server
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # public base URL; when set, setWebhook is called on startup
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+HANDLER_CONCURRENCY = int(os.getenv("HANDLER_CONCURRENCY", "64"))
+# outgoing messages per second: whole bot, one private chat, one group (Telegram's flood limits)
+SEND_RATE_GLOBAL = float(os.getenv("SEND_RATE_GLOBAL", "30"))
+SEND_RATE_CHAT = float(os.getenv("SEND_RATE_CHAT", "1"))
+SEND_RATE_GROUP = float(os.getenv("SEND_RATE_GROUP", "0.33"))
+# incoming messages/callbacks per user: sustained rate and burst; repeated taps of one button within TAP_WINDOW_MS act once
+USER_RATE = float(os.getenv("USER_RATE", "5"))
+USER_BURST = float(os.getenv("USER_BURST", "10"))
+TAP_WINDOW_MS = int(os.getenv("TAP_WINDOW_MS", "1000"))
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "10"))
+WORKERS = int(os.getenv("WORKERS", "1"))  # >1: front process + N worker processes sharded by user id
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR") or os.path.join(os.path.dirname(DB_PATH), "snapshots")
+SNAPSHOT_POLL_S = 5.0  # seconds between catalogue version checks in the front process
+ALLOWED_UPDATES = ["message", "callback_query", "inline_query"]
+IMPORT_PROGRESS_INTERVAL = 2.0  # seconds between progress message edits
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("city_guide_pro")
@@ -32,60 +110,128 @@ router = Router()
 CATEGORIES = ["Питание", "Достопримечательности", "Музеи", "События", "Парки", "Спортзалы"]
 
 # --- i18n helpers ---
-import json
-with open(os.path.join(I18N_DIR, "ru.json"), "r", encoding="utf-8") as f:
-    RU = json.load(f)
-with open(os.path.join(I18N_DIR, "en.json"), "r", encoding="utf-8") as f:
-    EN = json.load(f)
+# strings added after the bundled i18n files; a bundle's own value wins
+I18N_DEFAULTS = {
+    "ru": {
+        "import_progress": "Импорт… обработано строк: {count}",
+        "prev_page": "◀️ Назад",
+        "next_page": "Дальше ▶️",
+        "nearby_usage": "Сортировка: /nearby distance | rating | blend, радиус: /nearby 5",
+    },
+    "en": {
+        "import_progress": "Importing… {count} rows processed",
+        "prev_page": "◀️ Back",
+        "next_page": "Next ▶️",
+        "nearby_usage": "Sort: /nearby distance | rating | blend, radius: /nearby 5",
+    },
+}
+# each bundle is read on first use
+i18n = Bundles(I18N_DIR, I18N_DEFAULTS)
+
+def user_lang(user_id: int) -> str:
+    # lang from the prefs cache, which prefs_middleware fills for every update
+    prefs = prefs_store.peek(user_id)
+    return "ru" if not prefs or prefs["lang"] == "ru" else "en"
 
 def t(user_id: int, key: str, **kwargs) -> str:
-    # fetch lang from user_prefs
-    lang = "ru"
-    try:
-        lang = user_prefs_cache.get(user_id, {}).get("lang", "ru")
-    except:
-        pass
-    dct = RU if lang == "ru" else EN
-    return dct.get(key, key).format(**kwargs)
+    text = i18n.get(user_lang(user_id)).get(key, key)
+    return text.format(**kwargs) if kwargs else text
 
 # --- DB helpers ---
-async def get_db():
-    return await aiosqlite.connect(DB_PATH)
+# opened/closed by main(); every helper runs on one of its warm connections
+db_pool = DBPool(DB_PATH, readers=DB_READERS, slow_query_ms=SLOW_QUERY_MS)
+prefs_store = PrefsStore(db_pool, maxsize=PREFS_CACHE_SIZE, ttl=PREFS_CACHE_TTL,
+                         flush_interval=PREFS_FLUSH_MS / 1000)
+sessions = SessionStore(db_pool, maxsize=SESSION_CACHE_SIZE, flush_interval=SESSION_FLUSH_MS / 1000)
+favorites = FavoritesStore(db_pool, maxsize=FAV_CACHE_SIZE, flush_interval=FAV_FLUSH_MS / 1000)
+# derived caches are keyed on the catalogue version, which every import bumps
+catalogue = CatalogueVersion(db_pool)
+result_cache = ResultCache(maxsize=RESULT_CACHE_SIZE)
+random_index = RandomIndex()
+# NumPy nearby ranking; nearby_places() uses the R*Tree query while it is building or without NumPy
+geo_index = GeoIndex(rating_weight=NEARBY_RATING_WEIGHT)
+nearby_batch = NearbyBatcher(geo_index)
+optimizer = Optimizer(db_pool, interval=OPTIMIZE_INTERVAL_H * 3600)
+# mmapped catalogue shared by all workers; the front process builds it, workers only map it
+snapshots = Snapshots(SNAPSHOT_DIR, DB_PATH)
+# index of this worker process, None when running as a single process
+SHARD_INDEX: Optional[int] = None
+# inline search results per (city, normalized query, filters); short-lived, unlike category lists
+inline_cache = ResultCache(maxsize=INLINE_CACHE_SIZE, ttl=INLINE_CACHE_TTL)
+inline_latest = LatestOnly(debounce=INLINE_DEBOUNCE_MS / 1000)
+cards = CardRenderer(i18n.get, maxsize=CARD_CACHE_SIZE)
+
+# instrumentation, served on /metrics when METRICS_PORT is set
+metrics = Registry()
+timed = QueryTimer(metrics)
+handler_metrics = HandlerMetrics(metrics)
+loop_lag = LoopLagMonitor(metrics)
+startup = Startup(metrics, started=STARTED)
+warmup_task: Optional[asyncio.Task] = None
+metrics.register_caches({"prefs": prefs_store.stats, "results": result_cache.stats,
+                         "inline": inline_cache.stats, "cards": cards.stats, "favorites": favorites.stats})
+metrics_runner = None
+# workers share one bot token, so each gets its slice of the global send rate
+send_throttle = SendThrottle(metrics, global_rate=SEND_RATE_GLOBAL / max(1, WORKERS), chat_rate=SEND_RATE_CHAT,
+                             group_rate=SEND_RATE_GROUP)
+inbound_throttle = InboundThrottle(rate=USER_RATE, burst=USER_BURST, window=TAP_WINDOW_MS / 1000)
+metrics.gauge("city_guide_inbound_dropped_total", "Updates dropped by per-user throttling.", ("reason",),
+              collect=lambda: {(reason,): n for reason, n in inbound_throttle.dropped.items()}, kind="counter")
 
+@timed("list_cities")
 async def list_cities() -> List[str]:
-    async with await get_db() as db:
-        rows = await db.execute_fetchall("SELECT name FROM cities ORDER BY name")
-        return [r[0] for r in rows]
+    rows = await db_pool.fetchall("SELECT name FROM cities ORDER BY name")
+    return [r[0] for r in rows]
 
+@timed("get_city_id")
 async def get_city_id(name: str) -> Optional[int]:
-    async with await get_db() as db:
-        row = await db.execute_fetchone("SELECT id FROM cities WHERE name=?", (name,))
-        return row[0] if row else None
+    row = await db_pool.fetchone("SELECT id FROM cities WHERE name=?", (name,))
+    return row[0] if row else None
 
 def apply_filters_clause():
     return " AND ( (p.kids_friendly>=? ) AND (p.dog_friendly>=? ) AND ( (?=0) OR (p.price_level=?)) ) "
 
+@timed("search_places")
 async def search_places(city: Optional[str], q: str, prefs: dict, limit: int = 10):
-    sql = """
-        SELECT p.id, p.name, p.category, p.description, p.address, p.hours, p.rating, p.lat, p.lon, p.url, c.name,
-               p.kids_friendly, p.dog_friendly, p.price_level
-        FROM places p
-        JOIN cities c ON c.id = p.city_id
-        WHERE (p.name LIKE ? OR p.description LIKE ?)
-    """
-    args = [f"%{q}%", f"%{q}%"]
+    match = fts_query(q)
+    if match:
+        # FTS5 prefix match, ranked by bm25 blended with rating
+        sql = """
+            SELECT p.id, p.name, p.category, p.description, p.address, p.hours, p.rating, p.lat, p.lon, p.url, c.name,
+                   p.kids_friendly, p.dog_friendly, p.price_level
+            FROM places_fts f
+            JOIN places p ON p.id = f.rowid
+            JOIN cities c ON c.id = p.city_id
+        """
+        if city:
+            # only the city's hits are ranked, so cost follows its size, not the catalogue's
+            sql += f" WHERE places_fts MATCH {CITY_MATCH}"
+            args = [city, match]
+        else:
+            sql += " WHERE places_fts MATCH ?"
+            args = [match]
+        order = f" ORDER BY {RANK_EXPR} LIMIT ?"
+    else:
+        sql = """
+            SELECT p.id, p.name, p.category, p.description, p.address, p.hours, p.rating, p.lat, p.lon, p.url, c.name,
+                   p.kids_friendly, p.dog_friendly, p.price_level
+            FROM places p
+            JOIN cities c ON c.id = p.city_id
+            WHERE 1
+        """
+        args = []
+        order = " ORDER BY p.rating DESC LIMIT ?"
     if city:
         sql += " AND c.name = ?"
         args.append(city)
     # filters
     sql += apply_filters_clause()
     args += [prefs.get("kids_friendly", 0), prefs.get("dog_friendly", 0), prefs.get("price_level", 0), prefs.get("price_level", 0)]
-    sql += " ORDER BY p.rating DESC LIMIT ?"
+    sql += order
     args.append(limit)
-    async with await get_db() as db:
-        rows = await db.execute_fetchall(sql, args)
-        return rows
+    return await db_pool.fetchall(sql, args)
 
+@timed("places_by_category")
 async def places_by_category(city: str, category: str, prefs: dict, limit: int = 10):
     sql = """
         SELECT p.id, p.name, p.category, p.description, p.address, p.hours, p.rating, p.lat, p.lon, p.url,
@@ -99,11 +245,47 @@ async def places_by_category(city: str, category: str, prefs: dict, limit: int =
     args += [prefs.get("kids_friendly", 0), prefs.get("dog_friendly", 0), prefs.get("price_level", 0), prefs.get("price_level", 0)]
     sql += " ORDER BY p.rating DESC LIMIT ?"
     args.append(limit)
-    async with await get_db() as db:
-        rows = await db.execute_fetchall(sql, args)
-        return rows
+    return await db_pool.fetchall(sql, args)
+
+async def category_results(city: str, category: str, prefs: dict) -> CachedResult:
+    # results only change on import, so serve repeat presses from memory
+    key = ("cat", city, category, *filters_key(prefs))
+    version = catalogue.value
+    entry = result_cache.get(key, version)
+    if entry is None:
+        rows = await places_by_category(city, category, prefs, limit=RESULT_CACHE_DEPTH)
+        entry = result_cache.put(key, version, rows)
+    return entry
+
+def filters_key(prefs: dict) -> Tuple[int, int, int]:
+    return prefs.get("kids_friendly", 0), prefs.get("dog_friendly", 0), prefs.get("price_level", 0)
+
+async def top_rated(city: Optional[str], prefs: dict) -> CachedResult:
+    # shared by every user with the same city and filters; rebuilt only after an import
+    key = ("top", city, *filters_key(prefs))
+    version = catalogue.value
+    entry = result_cache.get(key, version)
+    if entry is None:
+        rows = await search_places(city, "", prefs, limit=RESULT_CACHE_DEPTH)
+        entry = result_cache.put(key, version, rows)
+    return entry
 
-async def random_place(city: str, prefs: dict):
+async def inline_search(city: Optional[str], q: str, prefs: dict) -> CachedResult:
+    # callers check inline_cache first; this is the miss path
+    version = catalogue.value
+    rows = await search_places(city, q, prefs, limit=RESULT_CACHE_DEPTH)
+    return inline_cache.put((city, q, *filters_key(prefs)), version, rows)
+
+@timed("random_place")
+async def random_place(city: str, prefs: dict, user_id: Optional[int] = None):
+    random_index.refresh(db_pool, catalogue.value)
+    if random_index.ready:
+        # constant-time pick from the in-memory index, then one primary-key fetch
+        pid = random_index.pick(city, prefs, user_id)
+        row = await get_place_by_id(pid) if pid is not None else None
+        if row or random_index.version == catalogue.value:
+            return row
+    # index still building or behind the catalogue: let SQLite pick
     sql = """
         SELECT p.id, p.name, p.category, p.description, p.address, p.hours, p.rating, p.lat, p.lon, p.url,
                p.kids_friendly, p.dog_friendly, p.price_level
@@ -115,115 +297,130 @@ async def random_place(city: str, prefs: dict):
     sql += apply_filters_clause()
     args += [prefs.get("kids_friendly", 0), prefs.get("dog_friendly", 0), prefs.get("price_level", 0), prefs.get("price_level", 0)]
     sql += " ORDER BY RANDOM() LIMIT 1"
-    async with await get_db() as db:
-        row = await db.execute_fetchone(sql, args)
-        return row
+    return await db_pool.fetchone(sql, args)
 
-async def nearby_places(lat: float, lon: float, prefs: dict, radius_km: float = 3.0, limit: int = 10):
-    sql = """
-        SELECT p.id, p.name, p.category, p.description, p.address, p.hours, p.rating, p.lat, p.lon, p.url, c.name,
-               p.kids_friendly, p.dog_friendly, p.price_level
-        FROM places p
-        JOIN cities c ON c.id = p.city_id
-    """
-    results = []
-    async with await get_db() as db:
-        async with db.execute(sql) as cursor:
-            async for pid, name, cat, descr, addr, hours, rating, plat, plon, url, city_name, kids, dog, price in cursor:
-                # filter
-                if kids < prefs.get("kids_friendly", 0): continue
-                if dog < prefs.get("dog_friendly", 0): continue
-                desired_price = prefs.get("price_level", 0)
-                if desired_price and price != desired_price: continue
-                d = haversine_km(lat, lon, plat, plon)
-                if d <= radius_km:
-                    results.append((d, pid, name, cat, descr, addr, hours, rating, plat, plon, url, city_name, kids, dog, price))
-    results.sort(key=lambda x: x[0])
-    return results[:limit]
+NEARBY_SQL = """
+    SELECT p.id, p.name, p.category, p.description, p.address, p.hours, p.rating, p.lat, p.lon, p.url, c.name,
+           p.kids_friendly, p.dog_friendly, p.price_level
+    FROM places_rtree r
+    JOIN places p ON p.id = r.id
+    JOIN cities c ON c.id = p.city_id
+    WHERE r.min_lat>=? AND r.max_lat<=? AND r.min_lon>=? AND r.max_lon<=?
+""" + apply_filters_clause()
+
+PLACES_BY_IDS_SQL = """
+    SELECT p.id, p.name, p.category, p.description, p.address, p.hours, p.rating, p.lat, p.lon, p.url, c.name,
+           p.kids_friendly, p.dog_friendly, p.price_level
+    FROM places p JOIN cities c ON c.id = p.city_id
+    WHERE p.id IN (SELECT value FROM json_each(?))
+"""
+
+def current_snapshot():
+    """The mapped catalogue snapshot; only sharded workers use one, a single process reads SQLite."""
+    if SHARD_INDEX is None:
+        return None
+    return snapshots.get(catalogue.identity, catalogue.value)
+
+async def places_by_ids(ids: List[int]) -> dict:
+    snap = current_snapshot()
+    if snap is not None:
+        rows = (snap.place(pid) for pid in ids)
+    else:
+        rows = await db_pool.fetchall(PLACES_BY_IDS_SQL, (json.dumps(ids),))
+    return {r[0]: r for r in rows if r}
 
+@timed("nearby_places")
+async def nearby_places(lat: float, lon: float, prefs: dict, radius_km: float = NEARBY_RADIUS_KM,
+                        limit: int = NEARBY_LIMIT, sort: str = NEARBY_SORT):
+    """(distance, *place row) tuples; the radius doubles up to NEARBY_MAX_RADIUS_KM until limit places match."""
+    if not (math.isfinite(radius_km) and radius_km > 0):
+        radius_km = NEARBY_RADIUS_KM
+    max_radius_km = max(radius_km, NEARBY_MAX_RADIUS_KM)
+    if geo_index.available:
+        geo_index.refresh(db_pool, catalogue.value, current_snapshot())
+        # while a rebuild for a new catalogue version runs, the old arrays may hold moved or deleted places
+        if geo_index.version == catalogue.value:
+            # one vectorised pass over the nearby cities, batched with concurrent lookups
+            _, hits = await nearby_batch.nearest(lat, lon, prefs, k=limit, radius_km=radius_km,
+                                                 max_radius_km=max_radius_km, sort=sort)
+            rows = await places_by_ids([pid for _, pid in hits])
+            return [(d, *rows[pid]) for d, pid in hits if pid in rows]
+    # R*Tree bounding-box prefilter, then exact haversine over the few candidates
+    filters = [prefs.get("kids_friendly", 0), prefs.get("dog_friendly", 0), prefs.get("price_level", 0), prefs.get("price_level", 0)]
+    while True:
+        rows = await db_pool.fetchall(NEARBY_SQL, [*bounding_box(lat, lon, radius_km), *filters])
+        results = nearest(lat, lon, rows, radius_km, limit, lat_idx=7, lon_idx=8, sort=sort, rating_idx=6,
+                          rating_weight=NEARBY_RATING_WEIGHT)
+        if len(results) >= limit or radius_km >= max_radius_km:
+            return results
+        # at least 0.1 km more each round, so a finite max_radius_km is always reached
+        radius_km = min(max(radius_km * 2, 0.1), max_radius_km)
+
+@timed("get_place_by_id")
 async def get_place_by_id(pid: int):
-    async with await get_db() as db:
-        row = await db.execute_fetchone("""
-            SELECT id, name, category, description, address, hours, rating, lat, lon, url, kids_friendly, dog_friendly, price_level
-            FROM places WHERE id=?
-        """, (pid,))
-        return row
+    snap = current_snapshot()
+    if snap is not None:
+        row = snap.place(pid)
+        # same columns as the query below, which has no city name
+        return row[:10] + row[11:] if row else None
+    return await db_pool.fetchone("""
+        SELECT id, name, category, description, address, hours, rating, lat, lon, url, kids_friendly, dog_friendly, price_level
+        FROM places WHERE id=?
+    """, (pid,))
 
+@timed("get_user_prefs")
 async def get_user_prefs(user_id: int) -> dict:
-    async with await get_db() as db:
-        row = await db.execute_fetchone("SELECT lang, kids_friendly, dog_friendly, price_level FROM user_prefs WHERE user_id=?", (user_id,))
-        if not row:
-            await db.execute("INSERT OR IGNORE INTO user_prefs(user_id) VALUES(?)", (user_id,))
-            await db.commit()
-            return {"lang":"ru", "kids_friendly":0, "dog_friendly":0, "price_level":0}
-        lang, kids, dog, price = row
-        return {"lang":lang, "kids_friendly":kids, "dog_friendly":dog, "price_level":price}
+    return await prefs_store.get(user_id)
 
 async def set_user_lang(user_id: int, lang: str):
-    async with await get_db() as db:
-        await db.execute("INSERT INTO user_prefs(user_id, lang) VALUES(?, ?) ON CONFLICT(user_id) DO UPDATE SET lang=excluded.lang", (user_id, lang))
-        await db.commit()
+    await prefs_store.set(user_id, "lang", lang)
 
 async def toggle_pref(user_id: int, field: str, cycle_vals: Tuple[int, ...]=(0,1)):
-    async with await get_db() as db:
-        row = await db.execute_fetchone(f"SELECT {field} FROM user_prefs WHERE user_id=?", (user_id,))
-        if not row:
-            cur = cycle_vals[0]
-        else:
-            cur = row[0]
-        idx = (cycle_vals.index(cur) + 1) % len(cycle_vals)
-        nxt = cycle_vals[idx]
-        await db.execute(f"INSERT INTO user_prefs(user_id,{field}) VALUES(?,?) ON CONFLICT(user_id) DO UPDATE SET {field}=excluded.{field}", (user_id, nxt))
-        await db.commit()
-        return nxt
+    return await prefs_store.toggle(user_id, field, cycle_vals)
 
 async def set_price(user_id: int, level: int):
     level = max(0, min(4, level))
-    async with await get_db() as db:
-        await db.execute("INSERT INTO user_prefs(user_id, price_level) VALUES(?, ?) ON CONFLICT(user_id) DO UPDATE SET price_level=excluded.price_level", (user_id, level))
-        await db.commit()
+    await prefs_store.set(user_id, "price_level", level)
 
+@timed("add_favorite")
 async def add_favorite(user_id: int, place_id: int):
-    async with await get_db() as db:
-        await db.execute("INSERT OR IGNORE INTO favorites(user_id, place_id) VALUES(?,?)", (user_id, place_id))
-        await db.commit()
+    await favorites.add(user_id, place_id)
 
+@timed("remove_favorite")
 async def remove_favorite(user_id: int, place_id: int):
-    async with await get_db() as db:
-        await db.execute("DELETE FROM favorites WHERE user_id=? AND place_id=?", (user_id, place_id))
-        await db.commit()
-
-async def list_favorites(user_id: int):
-    async with await get_db() as db:
-        rows = await db.execute_fetchall("""
-            SELECT p.id, p.name, p.category, p.description, p.address, p.hours, p.rating, p.lat, p.lon, p.url
-            FROM favorites f JOIN places p ON p.id=f.place_id
-            WHERE f.user_id=? ORDER BY p.rating DESC
-        """, (user_id,))
-        return rows
-
-user_city: dict[int, str] = {}
-user_prefs_cache: dict[int, dict] = {}
-
-def place_text(i18n_user_id, name, cat, descr, addr, hours, rating, lat, lon, url, city_name=None, kids=0, dog=0, price=0):
-    gmaps = f"https://maps.google.com/?q={lat},{lon}"
-    parts = [f"📍 <b>{name}</b> — {cat}",
-             f"⭐️ {rating:.1f}" if rating else "⭐️ —",
-             f"{descr}" if descr else "",
-             f"🏠 {addr}" if addr else "",
-             f"🕒 {hours}" if hours else ""]
-    tagline = []
-    if kids: tagline.append("👶")
-    if dog: tagline.append("🐶")
-    if price: tagline.append("💵" + "₁₂₃₄"[price-1])
-    if tagline:
-        parts.append(" ".join(tagline))
-    parts.append(f"🔗 <a href='{gmaps}'>{t(i18n_user_id,'open_maps')}</a>")
-    if url:
-        parts.append(f"🌐 <a href='{url}'>{t(i18n_user_id,'website')}</a>")
-    if city_name:
-        parts.append(f"🏙 {city_name}")
-    return "\n".join([p for p in parts if p])
+    await favorites.remove(user_id, place_id)
+
+@timed("is_favorite")
+async def is_favorite(user_id: int, place_id: int) -> bool:
+    return await favorites.contains(user_id, place_id)
+
+@timed("list_favorites")
+async def list_favorites(user_id: int, page: int = 0, page_size: int = PAGE_SIZE):
+    # ids come from the favorites store, so taps not flushed yet are listed too
+    ids = await favorites.ids(user_id)
+    if not ids:
+        return []
+    return await db_pool.fetchall("""
+        SELECT p.id, p.name, p.category, p.description, p.address, p.hours, p.rating, p.lat, p.lon, p.url, c.name,
+               p.kids_friendly, p.dog_friendly, p.price_level
+        FROM places p JOIN cities c ON c.id = p.city_id
+        WHERE p.id IN (SELECT value FROM json_each(?)) ORDER BY p.rating DESC, p.id LIMIT ? OFFSET ?
+    """, (json.dumps(sorted(ids)), page_size, page * page_size))
+
+async def init_db():
+    version = await migrate(db_pool)
+    logger.info("schema at version %s", version)
+
+async def get_user_city(user_id: int, default: Optional[str] = None) -> Optional[str]:
+    return await sessions.get(user_id, "city", default)
+
+async def set_user_city(user_id: int, city: str):
+    await sessions.set(user_id, "city", city)
+
+def place_text(i18n_user_id, pid, name, cat, descr, addr, hours, rating, lat, lon, url, city_name=None, kids=0, dog=0, price=0):
+    # cached per (place, language, catalogue version); callers always pass the place's own city
+    return cards.render(user_lang(i18n_user_id), catalogue.value, pid, name, cat, descr, addr, hours, rating,
+                        lat, lon, url, city_name, kids, dog, price)
 
 def categories_kb(city: str) -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
@@ -232,6 +429,26 @@ def categories_kb(city: str) -> InlineKeyboardMarkup:
     kb.adjust(2)
     return kb.as_markup()
 
+def category_page_kb(user_id: int, city: str, category: str, page: int, pages: int) -> Optional[InlineKeyboardMarkup]:
+    if pages <= 1:
+        return None
+    kb = InlineKeyboardBuilder()
+    if page > 0:
+        kb.button(text=t(user_id, "prev_page"), callback_data=f"catp:{page-1}:{city}:{category}")
+    if page < pages - 1:
+        kb.button(text=t(user_id, "next_page"), callback_data=f"catp:{page+1}:{city}:{category}")
+    return kb.as_markup()
+
+def fav_page_kb(user_id: int, page: int, pages: int) -> Optional[InlineKeyboardMarkup]:
+    if pages <= 1:
+        return None
+    kb = InlineKeyboardBuilder()
+    if page > 0:
+        kb.button(text=t(user_id, "prev_page"), callback_data=f"favp:{page-1}")
+    if page < pages - 1:
+        kb.button(text=t(user_id, "next_page"), callback_data=f"favp:{page+1}")
+    return kb.as_markup()
+
 def cities_kb(cities: List[str]) -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
     for c in cities:
@@ -248,7 +465,7 @@ def fav_kb(place_id: int, is_fav: bool):
     return kb.as_markup()
 
 def filters_kb(user_id: int):
-    prefs = user_prefs_cache.get(user_id, {"kids_friendly":0, "dog_friendly":0, "price_level":0})
+    prefs = prefs_store.peek(user_id) or DEFAULT_PREFS
     kids_val = t(user_id, "kids_on") if prefs.get("kids_friendly") else t(user_id, "kids_off")
     dog_val = t(user_id, "dog_on") if prefs.get("dog_friendly") else t(user_id, "dog_off")
     price = prefs.get("price_level", 0)
@@ -263,11 +480,24 @@ def filters_kb(user_id: int):
     return kb.as_markup()
 
 # --- Handlers ---
+async def prefs_middleware(handler, event, data):
+    # warm the prefs cache so t() and the handler's get_user_prefs() are hits; through the
+    # timed helper, so the misses' DB reads show up in city_guide_db_query_seconds
+    user = data.get("event_from_user")
+    if user:
+        await get_user_prefs(user.id)
+    return await handler(event, data)
+
+# inline queries are not throttled: LatestOnly already keeps one search per user
+for _observer in (router.message, router.callback_query):
+    _observer.outer_middleware(inbound_throttle)
+for _observer in (router.message, router.callback_query, router.inline_query):
+    _observer.outer_middleware(prefs_middleware)
+    _observer.middleware(handler_metrics)
+
 @router.message(CommandStart())
 async def cmd_start(message: Message):
-    user_city[message.from_user.id] = DEFAULT_CITY
-    prefs = await get_user_prefs(message.from_user.id)
-    user_prefs_cache[message.from_user.id] = prefs
+    await set_user_city(message.from_user.id, DEFAULT_CITY)
     await message.answer(t(message.from_user.id, "welcome"))
 
 @router.message(Command("city"))
@@ -278,23 +508,39 @@ async def cmd_city(message: Message):
 @router.callback_query(F.data.startswith("city:"))
 async def on_city_selected(cb: CallbackQuery):
     city = cb.data.split(":", 1)[1]
-    user_city[cb.from_user.id] = city
+    await set_user_city(cb.from_user.id, city)
     await cb.message.edit_text(t(cb.from_user.id, "city_set", city=city), reply_markup=categories_kb(city))
 
+async def show_category_page(cb: CallbackQuery, city: str, category: str, page: int):
+    prefs = await get_user_prefs(cb.from_user.id)
+    entry = await category_results(city, category, prefs)
+    if not entry.rows:
+        await cb.answer(t(cb.from_user.id, "nothing"), show_alert=True)
+        return
+    pages = entry.page_count(PAGE_SIZE)
+    page = max(0, min(page, pages - 1))
+    # rendering depends only on the language, so pages are shared between users
+    rendered = entry.pages.get((prefs["lang"], page))
+    if rendered is None:
+        text = t(cb.from_user.id, "category_top", category=category, city=city) + "\n\n"
+        chunks = []
+        for r in entry.page_rows(page, PAGE_SIZE):
+            (pid, name, cat, descr, addr, hours, rating, lat, lon, url, kids, dog, price) = r
+            chunks.append(place_text(cb.from_user.id, pid, name, cat, descr, addr, hours, rating, lat, lon, url, city, kids, dog, price))
+        rendered = entry.pages[(prefs["lang"], page)] = (
+            text + "\n\n".join(chunks), category_page_kb(cb.from_user.id, city, category, page, pages))
+    text, kb = rendered
+    await cb.message.edit_text(text, disable_web_page_preview=True, reply_markup=kb)
+
 @router.callback_query(F.data.startswith("cat:"))
 async def on_category(cb: CallbackQuery):
     _, city, category = cb.data.split(":", 2)
-    prefs = user_prefs_cache.get(cb.from_user.id, await get_user_prefs(cb.from_user.id))
-    rows = await places_by_category(city, category, prefs, limit=10)
-    if not rows:
-        await cb.answer(t(cb.from_user.id, "nothing"), show_alert=True)
-        return
-    text = t(cb.from_user.id, "category_top", category=category, city=city) + "\n\n"
-    chunks = []
-    for r in rows:
-        (pid, name, cat, descr, addr, hours, rating, lat, lon, url, kids, dog, price) = r
-        chunks.append(place_text(cb.from_user.id, name, cat, descr, addr, hours, rating, lat, lon, url, city, kids, dog, price))
-    await cb.message.edit_text(text + "\n\n".join(chunks), disable_web_page_preview=True)
+    await show_category_page(cb, city, category, 0)
+
+@router.callback_query(F.data.startswith("catp:"))
+async def on_category_page(cb: CallbackQuery):
+    _, page, city, category = cb.data.split(":", 3)
+    await show_category_page(cb, city, category, int(page))
 
 @router.message(Command("search"))
 async def cmd_search(message: Message, command: CommandObject):
@@ -302,51 +548,65 @@ async def cmd_search(message: Message, command: CommandObject):
     if not q:
         await message.answer(t(message.from_user.id, "search_usage"))
         return
-    prefs = user_prefs_cache.get(message.from_user.id, await get_user_prefs(message.from_user.id))
-    city = user_city.get(message.from_user.id)
+    prefs = await get_user_prefs(message.from_user.id)
+    # like inline mode: a catalogue-wide MATCH would rank hits from every city
+    city = await get_user_city(message.from_user.id, DEFAULT_CITY)
     rows = await search_places(city, q, prefs, limit=10)
     if not rows:
         await message.answer(t(message.from_user.id, "not_found"))
         return
     chunks = []
     for (pid, name, cat, descr, addr, hours, rating, lat, lon, url, city_name, kids, dog, price) in rows:
-        chunks.append(place_text(message.from_user.id, name, cat, descr, addr, hours, rating, lat, lon, url, city_name, kids, dog, price))
+        chunks.append(place_text(message.from_user.id, pid, name, cat, descr, addr, hours, rating, lat, lon, url, city_name, kids, dog, price))
     await message.answer("\n\n".join(chunks), disable_web_page_preview=True)
 
 @router.message(Command("random"))
 async def cmd_random(message: Message):
-    city = user_city.get(message.from_user.id, DEFAULT_CITY)
-    prefs = user_prefs_cache.get(message.from_user.id, await get_user_prefs(message.from_user.id))
-    row = await random_place(city, prefs)
+    city = await get_user_city(message.from_user.id, DEFAULT_CITY)
+    prefs = await get_user_prefs(message.from_user.id)
+    row = await random_place(city, prefs, message.from_user.id)
     if not row:
         await message.answer(t(message.from_user.id, "random_empty"))
         return
     (pid, name, cat, descr, addr, hours, rating, lat, lon, url, kids, dog, price) = row
-    text = place_text(message.from_user.id, name, cat, descr, addr, hours, rating, lat, lon, url, city, kids, dog, price)
-    # Check favorite
-    async with await get_db() as db:
-        fav = await db.execute_fetchone("SELECT 1 FROM favorites WHERE user_id=? AND place_id=?", (message.from_user.id, pid))
-        is_fav = bool(fav)
+    text = place_text(message.from_user.id, pid, name, cat, descr, addr, hours, rating, lat, lon, url, city, kids, dog, price)
+    is_fav = await is_favorite(message.from_user.id, pid)
     await message.answer(text, disable_web_page_preview=True, reply_markup=fav_kb(pid, is_fav))
 
 @router.message(Command("nearby"))
-async def cmd_nearby(message: Message):
+async def cmd_nearby(message: Message, command: CommandObject):
+    user_id = message.from_user.id
+    # "/nearby 5 rating": radius in km and/or sort mode, remembered for the next locations
+    for arg in (command.args or "").lower().split():
+        if arg in SORT_MODES:
+            await sessions.set(user_id, "nearby_sort", arg)
+            continue
+        try:
+            km = float(arg.replace(",", "."))
+        except ValueError:
+            continue
+        # float() also takes "nan" and "inf"
+        if math.isfinite(km):
+            await sessions.set(user_id, "nearby_km", min(max(km, 0.1), NEARBY_MAX_RADIUS_KM))
+    km = await sessions.get(user_id, "nearby_km", NEARBY_RADIUS_KM)
     kb = ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="📍 Поделиться геолокацией", request_location=True)]],
                              resize_keyboard=True, one_time_keyboard=True)
-    await message.answer(t(message.from_user.id, "nearby_prompt", km=3), reply_markup=kb)
+    await message.answer(t(user_id, "nearby_prompt", km=f"{km:g}") + "\n" + t(user_id, "nearby_usage"), reply_markup=kb)
 
 @router.message(F.location)
 async def on_location(message: Message):
     lat = message.location.latitude
     lon = message.location.longitude
-    prefs = user_prefs_cache.get(message.from_user.id, await get_user_prefs(message.from_user.id))
-    results = await nearby_places(lat, lon, prefs, radius_km=3.0, limit=10)
+    prefs = await get_user_prefs(message.from_user.id)
+    km = await sessions.get(message.from_user.id, "nearby_km", NEARBY_RADIUS_KM)
+    sort = await sessions.get(message.from_user.id, "nearby_sort", NEARBY_SORT)
+    results = await nearby_places(lat, lon, prefs, radius_km=km, sort=sort)
     if not results:
         await message.answer(t(message.from_user.id, "nearby_empty"))
         return
     chunks = []
     for d, pid, name, cat, descr, addr, hours, rating, plat, plon, url, city_name, kids, dog, price in results:
-        txt = place_text(message.from_user.id, name, cat, descr, addr, hours, rating, plat, plon, url, city_name, kids, dog, price)
+        txt = place_text(message.from_user.id, pid, name, cat, descr, addr, hours, rating, plat, plon, url, city_name, kids, dog, price)
         chunks.append(f"~{d:.2f} км\n{txt}")
     await message.answer("\n\n".join(chunks), disable_web_page_preview=True, reply_markup=ReplyKeyboardRemove())
 
@@ -361,23 +621,42 @@ async def on_fav(cb: CallbackQuery):
     else:
         await remove_favorite(cb.from_user.id, pid)
         await cb.answer(t(cb.from_user.id, "fav_removed"))
+    # flip the button on the card itself
+    try:
+        await cb.message.edit_reply_markup(reply_markup=fav_kb(pid, action == "add"))
+    except TelegramBadRequest:
+        pass  # already showing that state (double tap)
+
+async def fav_page(user_id: int, page: int) -> Tuple[Optional[str], Optional[InlineKeyboardMarkup]]:
+    pages = (len(await favorites.ids(user_id)) + PAGE_SIZE - 1) // PAGE_SIZE
+    if not pages:
+        return None, None
+    page = max(0, min(page, pages - 1))
+    chunks = []
+    for (pid, name, cat, descr, addr, hours, rating, lat, lon, url, city_name, kids, dog, price) in await list_favorites(user_id, page):
+        chunks.append(place_text(user_id, pid, name, cat, descr, addr, hours, rating, lat, lon, url, city_name, kids, dog, price))
+    return t(user_id, "favorites_title") + "\n\n" + "\n\n".join(chunks), fav_page_kb(user_id, page, pages)
 
 @router.message(Command("fav"))
 async def cmd_fav(message: Message):
-    rows = await list_favorites(message.from_user.id)
-    if not rows:
+    text, kb = await fav_page(message.from_user.id, 0)
+    if text is None:
         await message.answer(t(message.from_user.id, "favorites_empty"))
         return
-    chunks = []
-    for (pid, name, cat, descr, addr, hours, rating, lat, lon, url) in rows:
-        chunks.append(place_text(message.from_user.id, name, cat, descr, addr, hours, rating, lat, lon, url))
-    await message.answer(t(message.from_user.id, "favorites_title") + "\n\n" + "\n\n".join(chunks), disable_web_page_preview=True)
+    await message.answer(text, disable_web_page_preview=True, reply_markup=kb)
+
+@router.callback_query(F.data.startswith("favp:"))
+async def on_fav_page(cb: CallbackQuery):
+    text, kb = await fav_page(cb.from_user.id, int(cb.data.split(":", 1)[1]))
+    if text is None:
+        await cb.answer(t(cb.from_user.id, "favorites_empty"), show_alert=True)
+        return
+    await cb.message.edit_text(text, disable_web_page_preview=True, reply_markup=kb)
 
 # --- Filters ---
 @router.message(Command("filters"))
 async def cmd_filters(message: Message):
-    prefs = user_prefs_cache.get(message.from_user.id, await get_user_prefs(message.from_user.id))
-    user_prefs_cache[message.from_user.id] = prefs
+    prefs = await get_user_prefs(message.from_user.id)
     kids_txt = t(message.from_user.id, "kids_on") if prefs.get("kids_friendly") else t(message.from_user.id, "kids_off")
     dog_txt = t(message.from_user.id, "dog_on") if prefs.get("dog_friendly") else t(message.from_user.id, "dog_off")
     price = prefs.get("price_level", 0)
@@ -394,9 +673,11 @@ async def on_filter(cb: CallbackQuery):
     elif parts[1] == "price":
         level = int(parts[2])
         await set_price(cb.from_user.id, level)
-    prefs = await get_user_prefs(cb.from_user.id)
-    user_prefs_cache[cb.from_user.id] = prefs
-    await cb.message.edit_reply_markup(reply_markup=filters_kb(cb.from_user.id))
+    try:
+        await cb.message.edit_reply_markup(reply_markup=filters_kb(cb.from_user.id))
+    except TelegramBadRequest:
+        # same price tapped again: the keyboard did not change
+        pass
     await cb.answer("OK")
 
 # --- Language ---
@@ -412,7 +693,6 @@ async def cmd_lang(message: Message):
 async def on_lang(cb: CallbackQuery):
     lang = cb.data.split(":")[1]
     await set_user_lang(cb.from_user.id, lang)
-    user_prefs_cache[cb.from_user.id] = await get_user_prefs(cb.from_user.id)
     await cb.answer(t(cb.from_user.id, "lang_set", lang=lang))
     await cb.message.delete()
 
@@ -423,75 +703,387 @@ async def cmd_import_hint(message: Message):
 
 @router.message(F.document & (F.document.mime_type == "text/csv"))
 async def on_csv_upload(message: Message):
+    uid = message.from_user.id
+    # one file per upload: the import streams it across awaits while another upload may be downloading
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(DB_PATH), prefix="upload-", suffix=".csv", delete=False) as f:
+        tmp_path = f.name
     try:
         file = await message.bot.get_file(message.document.file_id)
-        tmp_path = os.path.join(os.path.dirname(__file__), "db", "upload.csv")
         await message.bot.download_file(file.file_path, tmp_path)
-        count = 0
-        async with aiosqlite.connect(DB_PATH) as db:
-            with open(tmp_path, newline="", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    city = row.get("city","").strip()
-                    if not city: continue
-                    # ensure city exists
-                    await db.execute("INSERT OR IGNORE INTO cities(name) VALUES(?)", (city,))
-                    c_row = await db.execute_fetchone("SELECT id FROM cities WHERE name=?", (city,))
-                    cid = c_row[0]
-                    def as_float(x, default=0.0):
-                        try: return float(str(x).strip())
-                        except: return default
-                    def as_int(x, default=0):
-                        try:
-                            v = int(float(str(x).strip()))
-                            return v
-                        except: return default
-                    kids = as_int(row.get("kids_friendly",0))
-                    dog = as_int(row.get("dog_friendly",0))
-                    price = as_int(row.get("price_level",0))
-                    await db.execute("""
-                        INSERT INTO places(city_id, name, category, lat, lon, description, address, hours, rating, url, kids_friendly, dog_friendly, price_level)
-                        VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?)
-                    """, (cid, row.get("name",""), row.get("category",""), as_float(row.get("lat")), as_float(row.get("lon")),
-                          row.get("description",""), row.get("address",""), row.get("hours",""), as_float(row.get("rating",0)),
-                          row.get("url",""), kids, dog, price))
-                    count += 1
-            await db.commit()
-        await message.answer(t(message.from_user.id, "import_ok", count=count))
+        # rows update places with the same (city, name) unless captioned "append"
+        upsert = (message.caption or "").strip().lower() != "append"
+        status = await message.answer(t(uid, "import_progress", count=0))
+        last_edit = time.monotonic()
+        edit: Optional[asyncio.Task] = None
+
+        async def edit_progress(count: int):
+            try:
+                await status.edit_text(t(uid, "import_progress", count=count))
+            except Exception as e:
+                logger.warning("import progress update failed: %s", e)
+
+        async def progress(count: int):
+            # called inside the import transaction: never wait for the send (it may queue
+            # behind flood limits); an edit still in flight makes this count stale, so skip it
+            nonlocal last_edit, edit
+            if time.monotonic() - last_edit < IMPORT_PROGRESS_INTERVAL or (edit is not None and not edit.done()):
+                return
+            last_edit = time.monotonic()
+            edit = asyncio.create_task(edit_progress(count))
+
+        try:
+            # one transaction for the whole file; readers keep serving the old snapshot
+            async with db_pool.write() as db:
+                count = await import_csv(db, tmp_path, upsert=upsert, progress=progress)
+        finally:
+            if edit is not None and not edit.done():
+                # the final message below must not be overwritten by a late progress edit
+                edit.cancel()
+        version = await catalogue.refresh()
+        # rebuild the derived indexes now rather than on the first /random or /nearby after the import
+        random_index.refresh(db_pool, version)
+        if geo_index.available:
+            geo_index.refresh(db_pool, version, current_snapshot())
+        # row counts changed a lot; refresh planner statistics off the hot path
+        optimizer.analyze_soon()
+        await status.edit_text(t(uid, "import_ok", count=count))
     except Exception as e:
-        await message.answer(t(message.from_user.id, "import_fail", error=str(e)))
+        await message.answer(t(uid, "import_fail", error=str(e)))
+    finally:
+        os.remove(tmp_path)
 
 # --- Inline mode ---
 @router.inline_query()
 async def inline_query_handler(inline_query: InlineQuery):
-    q = (inline_query.query or "").strip()
+    q = normalize_query(inline_query.query or "")
     user_id = inline_query.from_user.id
-    prefs = user_prefs_cache.get(user_id, await get_user_prefs(user_id))
-    city = user_city.get(user_id, DEFAULT_CITY)
+    prefs = await get_user_prefs(user_id)
+    city = await get_user_city(user_id, DEFAULT_CITY)
     if not q:
-        q = ""  # empty → show random or top?
-    rows = await search_places(city, q, prefs, limit=20)
-    results = []
-    for (pid, name, cat, descr, addr, hours, rating, lat, lon, url, city_name, kids, dog, price) in rows:
-        text = place_text(user_id, name, cat, descr, addr, hours, rating, lat, lon, url, city_name, kids, dog, price)
-        results.append(InlineQueryResultArticle(
-            id=str(pid),
-            title=name,
-            description=f"{cat} • ⭐ {rating:.1f}" if rating else cat,
-            input_message_content=InputTextMessageContent(message_text=text, parse_mode="HTML"),
-        ))
-    await inline_query.answer(results, cache_time=1, is_personal=True)
+        # empty query → the city's top rated places
+        inline_latest.cancel(user_id)
+        entry = await top_rated(city, prefs)
+    else:
+        entry = inline_cache.get((city, q, *filters_key(prefs)), catalogue.value)
+        if entry is not None:
+            inline_latest.cancel(user_id)
+        else:
+            # one search per user at a time; a newer keystroke cancels this one
+            entry = await inline_latest.run(user_id, lambda: inline_search(city, q, prefs))
+            if entry is None:
+                return
+    offset = int(inline_query.offset) if (inline_query.offset or "").isdigit() else 0
+    results = entry.pages.get((prefs["lang"], "inline", offset))
+    if results is None:
+        results = []
+        for (pid, name, cat, descr, addr, hours, rating, lat, lon, url, city_name, kids, dog, price) in entry.rows[offset:offset + INLINE_PAGE_SIZE]:
+            text = place_text(user_id, pid, name, cat, descr, addr, hours, rating, lat, lon, url, city_name, kids, dog, price)
+            results.append(InlineQueryResultArticle(
+                id=str(pid),
+                title=name,
+                description=f"{cat} • ⭐ {rating:.1f}" if rating else cat,
+                input_message_content=InputTextMessageContent(message_text=text, parse_mode="HTML"),
+            ))
+        entry.pages[(prefs["lang"], "inline", offset)] = results
+    next_offset = str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(entry.rows) else ""
+    # answers depend on the user's city, filters and language, so they stay personal; Telegram
+    # would hand a non-personal answer to anyone typing the same query. Users share the
+    # in-process top_rated/inline caches instead, and the short cache_time lets a changed
+    # /city, /filters or /lang show up on the next keystroke
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True, next_offset=next_offset)
+
+# --- Lifecycle ---
+update_limiter = ConcurrencyLimiter(HANDLER_CONCURRENCY)
+metrics.gauge("city_guide_updates_in_flight", "Updates being handled or waiting for a slot.",
+              collect=lambda: {(): update_limiter.in_flight})
+
+# index and planner pages read by the list, nearby and search queries; reading them once
+# pulls them into the OS page cache instead of the first users' requests doing it
+PAGE_WARM_SQL = (
+    "SELECT count(*) FROM places INDEXED BY idx_places_city_category_rating",
+    "SELECT count(*) FROM places INDEXED BY idx_places_city_rating",
+    "SELECT count(*) FROM places_rtree",
+    "SELECT count(*) FROM places_fts",
+)
+
+async def warmup():
+    """Fill what the first requests would otherwise pay for; handlers fall back to SQL meanwhile."""
+    try:
+        version = catalogue.value
+        with startup.phase("random_index"):
+            task = random_index.refresh(db_pool, version)
+            if task is not None:
+                await task
+        if geo_index.available:
+            with startup.phase("geo_index"):
+                task = geo_index.refresh(db_pool, version, current_snapshot())
+                if task is not None:
+                    await task
+        with startup.phase("cities"):
+            cities = await list_cities()
+        # the default city first, most users never pick another
+        cities = sorted(cities, key=lambda c: c != DEFAULT_CITY)[:WARMUP_CITIES]
+        with startup.phase("result_lists"):
+            for city in cities:
+                await top_rated(city, DEFAULT_PREFS)
+                for category in CATEGORIES:
+                    await category_results(city, category, DEFAULT_PREFS)
+        with startup.phase("page_cache"):
+            for sql in PAGE_WARM_SQL:
+                await db_pool.fetchone(sql)
+    except Exception as e:
+        logger.warning("warmup failed: %s", e)
+    startup.ready = True
+    startup.mark("ready")
+    logger.info("startup: %s", startup.summary())
+
+async def on_startup():
+    global metrics_runner, warmup_task
+    loop_lag.start()
+    if METRICS_PORT:
+        # one endpoint per worker: METRICS_PORT, METRICS_PORT+1, ...
+        metrics_runner = await start_metrics_server(metrics, METRICS_HOST, METRICS_PORT + (SHARD_INDEX or 0),
+                                                    is_ready=lambda: startup.ready)
+    # only what correctness needs runs before updates are accepted
+    with startup.phase("db_open"):
+        await db_pool.open()
+    with startup.phase("migrate"):
+        await init_db()
+    with startup.phase("catalogue"):
+        await catalogue.refresh()
+    catalogue.start()
+    prefs_store.start()
+    sessions.start()
+    favorites.start()
+    optimizer.start()
+    warmup_task = asyncio.create_task(warmup())
+    logger.info("serving %.0f ms after start, warming up in the background", startup.mark("serving") * 1000)
+
+async def on_shutdown():
+    global metrics_runner
+    # let in-flight handlers finish while the DB pool and bot session are still open
+    if not await update_limiter.drain(SHUTDOWN_TIMEOUT):
+        logger.warning("shutdown: %s updates still in flight after %ss", update_limiter.in_flight, SHUTDOWN_TIMEOUT)
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+        try:
+            await warmup_task
+        except asyncio.CancelledError:
+            pass
+    await catalogue.close()
+    await prefs_store.close()
+    await sessions.close()
+    await favorites.close()
+    await optimizer.close()
+    await random_index.close()
+    await geo_index.close()
+    await snapshots.close()
+    await db_pool.close()
+    await loop_lag.close()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+        metrics_runner = None
+
+def create_bot() -> Bot:
+    session = None
+    if TELEGRAM_API_URL:
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    bot = Bot(BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"))
+    bot.session.middleware(send_throttle)
+    return bot
+
+def create_dispatcher() -> Dispatcher:
+    dp = Dispatcher()
+    dp.update.outer_middleware(update_limiter)
+    dp.include_router(router)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
+
+def stop_event() -> asyncio.Event:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    return stop
+
+async def run_webhook(bot: Bot, dp: Dispatcher, unix_path: Optional[str] = None):
+    from aiohttp import web
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+    app = web.Application()
+    # dispatcher shutdown (drain + DB close) must run before the handler closes the bot session
+    setup_application(app, dp, bot=bot)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET or None).register(app, path=WEBHOOK_PATH)
+    app.router.add_get("/ready", ready_handler(lambda: startup.ready))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    if unix_path:
+        # a sharded worker: the front process forwards updates over this socket
+        await web.UnixSite(runner, unix_path).start()
+        logger.info("worker %s listening on %s", SHARD_INDEX, unix_path)
+    else:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        logger.info("webhook listening on %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+        if WEBHOOK_URL:
+            await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None,
+                                  allowed_updates=ALLOWED_UPDATES)
+    stop = stop_event()
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+# --- Sharded deployment (WORKERS > 1) ---
+# The front process receives updates (webhook or getUpdates) and forwards each
+# to the worker owning its user; workers are ordinary webhook bots on unix sockets.
+
+def worker_main(index: int, unix_path: str):
+    """Worker process entry point (spawned, so this module is imported afresh)."""
+    global SHARD_INDEX
+    SHARD_INDEX = index
+    asyncio.run(run_webhook(create_bot(), create_dispatcher(), unix_path=unix_path))
+
+def join_workers(procs: List[multiprocessing.Process], timeout: float):
+    deadline = time.monotonic() + timeout
+    for proc in procs:
+        proc.join(max(0.0, deadline - time.monotonic()))
+        if proc.is_alive():
+            logger.warning("%s did not stop in %ss, killing it", proc.name, timeout)
+            proc.kill()
+            proc.join()
+
+async def supervise(procs: List[multiprocessing.Process], start_worker, stop: asyncio.Event):
+    # rebuild the snapshot when an import bumps the catalogue version, restart crashed workers
+    while not stop.is_set():
+        try:
+            await snapshots.refresh()
+        except Exception as e:
+            logger.warning("catalogue snapshot failed: %s", e)
+        for i, proc in enumerate(procs):
+            if not proc.is_alive() and not stop.is_set():
+                logger.warning("%s exited with %s, restarting", proc.name, proc.exitcode)
+                procs[i] = start_worker(i)
+        try:
+            await asyncio.wait_for(stop.wait(), SNAPSHOT_POLL_S)
+        except asyncio.TimeoutError:
+            pass
+
+async def front_webhook(bot: Bot, shards: ShardRouter, stop: asyncio.Event):
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=401, text="Unauthorized")
+        body = await request.read()
+        await shards.forward(json.loads(body), body)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    # ready once every worker is: a load balancer checks the front, not the unix sockets
+    app.router.add_get("/ready", ready_handler(shards.ready))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logger.info("front webhook listening on %s:%s%s, %s workers", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WORKERS)
+    if WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None,
+                              allowed_updates=ALLOWED_UPDATES)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+async def front_polling(bot: Bot, shards: ShardRouter, stop: asyncio.Event, polling_timeout: int = 30):
+    logger.info("front polling, %s workers", WORKERS)
+    stopping = asyncio.create_task(stop.wait())
+    offset = None
+    try:
+        while not stop.is_set():
+            poll = asyncio.create_task(bot.get_updates(offset=offset, timeout=polling_timeout,
+                                                       allowed_updates=ALLOWED_UPDATES,
+                                                       request_timeout=int(bot.session.timeout + polling_timeout)))
+            await asyncio.wait((poll, stopping), return_when=asyncio.FIRST_COMPLETED)
+            if not poll.done():
+                poll.cancel()
+                break
+            try:
+                updates = poll.result()
+            except Exception as e:
+                logger.warning("getUpdates failed: %s", e)
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                await shards.forward(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+    finally:
+        stopping.cancel()
+
+async def run_front(bot: Bot):
+    # migrate here so workers start on the current schema instead of racing to migrate it
+    await db_pool.open()
+    try:
+        await init_db()
+    finally:
+        await db_pool.close()
+    stop = stop_event()
+    await snapshots.refresh()
+
+    sock_dir = tempfile.mkdtemp(prefix="city_guide_")
+    paths = [os.path.join(sock_dir, f"worker{i}.sock") for i in range(WORKERS)]
+    ctx = multiprocessing.get_context("spawn")
+
+    def start_worker(i: int) -> multiprocessing.Process:
+        proc = ctx.Process(target=worker_main, args=(i, paths[i]), name=f"worker-{i}")
+        proc.start()
+        return proc
+
+    procs = [start_worker(i) for i in range(WORKERS)]
+    shards = ShardRouter(paths, WEBHOOK_PATH, WEBHOOK_SECRET)
+    shards.start()
+    if not await shards.wait_ready(60):
+        logger.warning("workers not listening after 60s, forwarding anyway")
+    supervisor = asyncio.create_task(supervise(procs, start_worker, stop))
+    try:
+        if BOT_MODE == "webhook":
+            await front_webhook(bot, shards, stop)
+        else:
+            await front_polling(bot, shards, stop)
+    finally:
+        stop.set()
+        await supervisor
+        # SIGTERM makes each worker drain its in-flight updates before exiting
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+        await asyncio.to_thread(join_workers, procs, SHUTDOWN_TIMEOUT + 5)
+        await shards.close()
+        await snapshots.close()
+        await bot.session.close()
+        shutil.rmtree(sock_dir, ignore_errors=True)
 
 async def main():
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN is not set. On Replit add it in Secrets.")
-    bot = Bot(BOT_TOKEN, parse_mode="HTML")
-    dp = Dispatcher()
-    dp.include_router(router)
+    bot = create_bot()
+    if WORKERS > 1:
+        await run_front(bot)
+        return
+    dp = create_dispatcher()
+    if BOT_MODE == "webhook":
+        await run_webhook(bot, dp)
+        return
     try:
-        await dp.start_polling(bot, allowed_updates=["message", "callback_query", "inline_query"])
+        await dp.start_polling(bot, allowed_updates=ALLOWED_UPDATES)
     finally:
         await bot.session.close()
 
+startup.mark("import")
+
 if __name__ == "__main__":
     asyncio.run(main())
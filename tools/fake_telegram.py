@@ -0,0 +1,116 @@
+"""Fake Telegram for trying webhook mode locally.
+
+Serves a minimal Bot API (every method succeeds) and POSTs synthetic updates
+to the bot's webhook, then prints the API calls the bot made. Run the bot
+against it with:
+
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_MODE=webhook WEBHOOK_SECRET=s python bot.py
+    python tools/fake_telegram.py --webhook http://127.0.0.1:8080/webhook --secret s
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+
+from aiohttp import ClientConnectionError, ClientSession, web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "GuideBot", "username": "guide_bot"}
+
+calls: Counter = Counter()
+_message_ids = itertools.count(1000)
+
+
+def _message(chat_id, text):
+    return {"message_id": next(_message_ids), "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER, "text": text}
+
+
+async def api_handler(request: web.Request) -> web.Response:
+    method = request.match_info["method"]
+    calls[method] += 1
+    params = dict(await request.post()) if request.can_read_body else {}
+    result = True
+    if method == "getMe":
+        result = BOT_USER
+    elif method in ("sendMessage", "editMessageText"):
+        result = _message(int(params.get("chat_id", 0) or 0), params.get("text", ""))
+    return web.json_response({"ok": True, "result": result})
+
+
+def synthetic_updates(users: int, per_user: int):
+    ids = itertools.count(1)
+    now = int(time.time())
+    for n in range(per_user):
+        for uid in range(1, users + 1):
+            user = {"id": uid, "is_bot": False, "first_name": f"user{uid}"}
+            chat = {"id": uid, "type": "private"}
+            kind = n % 4
+            if kind == 0:
+                text = "/search bat"
+                yield {"update_id": next(ids), "message": {
+                    "message_id": n, "date": now, "chat": chat, "from": user, "text": text,
+                    "entities": [{"type": "bot_command", "offset": 0, "length": 7}]}}
+            elif kind == 1:
+                yield {"update_id": next(ids), "message": {
+                    "message_id": n, "date": now, "chat": chat, "from": user,
+                    "location": {"latitude": 41.65, "longitude": 41.636}}}
+            elif kind == 2:
+                yield {"update_id": next(ids), "callback_query": {
+                    "id": f"{uid}-{n}", "from": user, "chat_instance": "x", "data": "cat:Batumi:Музеи",
+                    "message": {"message_id": 1, "date": now, "chat": chat, "from": BOT_USER, "text": "x"}}}
+            else:
+                yield {"update_id": next(ids), "inline_query": {
+                    "id": f"{uid}-{n}", "from": user, "query": "ba", "offset": ""}}
+
+
+async def post_updates(webhook: str, secret: str, users: int, per_user: int, concurrency: int):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    statuses: Counter = Counter()
+    sem = asyncio.Semaphore(concurrency)
+    async with ClientSession() as http:
+        async def post(update):
+            async with sem:
+                try:
+                    async with http.post(webhook, data=json.dumps(update), headers={
+                            "Content-Type": "application/json", **headers}) as resp:
+                        statuses[resp.status] += 1
+                except ClientConnectionError:
+                    # e.g. the bot is shutting down and no longer accepts connections
+                    statuses["refused"] += 1
+        started = time.perf_counter()
+        await asyncio.gather(*(post(u) for u in synthetic_updates(users, per_user)))
+        elapsed = time.perf_counter() - started
+    print(f"posted {sum(statuses.values())} updates in {elapsed:.2f}s, HTTP statuses: {dict(statuses)}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--webhook", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--per-user", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--settle", type=float, default=2.0, help="seconds to wait for the bot's replies")
+    parser.add_argument("--serve", action="store_true", help="keep the fake API running after posting")
+    args = parser.parse_args()
+
+    app = web.Application()
+    app.router.add_route("POST", "/bot{token}/{method}", api_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.api_port).start()
+    try:
+        await post_updates(args.webhook, args.secret, args.users, args.per_user, args.concurrency)
+        await asyncio.sleep(args.settle)
+        print("Bot API calls received:", dict(calls))
+        if args.serve:
+            await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,43 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+
+class BackgroundTask:
+    """One asyncio task owned by a component.
+
+    start() launches run() unless it is still running; close() cancels it
+    and waits until it has stopped, so shutdown never leaves it behind.
+    """
+
+    def __init__(self, run: Callable[[], Awaitable[None]]):
+        self._run = run
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        task, self._task = self._task, None
+        if task is None or task.done():
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+async def every(interval: float, func: Callable[[], Awaitable[object]], logger: logging.Logger, what: str):
+    """Await func() every interval seconds until cancelled; a failure is logged and retried next round."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await func()
+        except Exception as e:
+            logger.warning("%s failed: %s", what, e)
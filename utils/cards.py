@@ -0,0 +1,74 @@
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Mapping, Optional, Tuple
+
+_PRICE_DIGITS = "₁₂₃₄"
+
+
+class CardRenderer:
+    """Place cards rendered from per-language templates and memoized.
+
+    A card depends only on the place row and the language, and rows only
+    change with the catalogue, so cards are cached per (place_id, lang,
+    catalogue version) and lists are joined from cached fragments. The
+    translated link labels are resolved once per language instead of per card.
+    """
+
+    def __init__(self, bundle: Callable[[str], Mapping[str, str]], maxsize: int = 20000):
+        self._bundle = bundle
+        self.maxsize = maxsize
+        # lang -> (maps link suffix, website link suffix)
+        self._templates: Dict[str, Tuple[str, str]] = {}
+        self._cards: "OrderedDict[Hashable, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _template(self, lang: str) -> Tuple[str, str]:
+        tpl = self._templates.get(lang)
+        if tpl is None:
+            labels = self._bundle(lang)
+            tpl = self._templates[lang] = (
+                "'>" + labels.get("open_maps", "open_maps") + "</a>",
+                "'>" + labels.get("website", "website") + "</a>",
+            )
+        return tpl
+
+    def render(self, lang: str, version: int, pid: int, name, cat, descr, addr, hours, rating, lat, lon, url,
+               city_name: Optional[str] = None, kids=0, dog=0, price=0) -> str:
+        key = (pid, lang, version)
+        card = self._cards.get(key)
+        if card is not None:
+            self.hits += 1
+            self._cards.move_to_end(key)
+            return card
+        self.misses += 1
+        maps_suffix, website_suffix = self._template(lang)
+        parts = [f"📍 <b>{name}</b> — {cat}", f"⭐️ {rating:.1f}" if rating else "⭐️ —"]
+        if descr:
+            parts.append(f"{descr}")
+        if addr:
+            parts.append(f"🏠 {addr}")
+        if hours:
+            parts.append(f"🕒 {hours}")
+        tagline = []
+        if kids: tagline.append("👶")
+        if dog: tagline.append("🐶")
+        if price: tagline.append("💵" + _PRICE_DIGITS[price-1])
+        if tagline:
+            parts.append(" ".join(tagline))
+        parts.append(f"🔗 <a href='https://maps.google.com/?q={lat},{lon}" + maps_suffix)
+        if url:
+            parts.append(f"🌐 <a href='{url}" + website_suffix)
+        if city_name:
+            parts.append(f"🏙 {city_name}")
+        card = self._cards[key] = "\n".join(parts)
+        while len(self._cards) > self.maxsize:
+            self._cards.popitem(last=False)
+        return card
+
+    def clear(self):
+        self._cards.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self._cards), "hits": self.hits, "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0}
@@ -0,0 +1,59 @@
+import logging
+
+from utils.background import BackgroundTask, every
+
+logger = logging.getLogger("city_guide_pro.catalogue")
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS catalogue_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+    "INSERT OR IGNORE INTO catalogue_meta(key, value) VALUES ('version', 0)",
+)
+
+_SELECT = "SELECT key, value FROM catalogue_meta WHERE key IN ('version', 'identity')"
+_BUMP = "UPDATE catalogue_meta SET value=value+1 WHERE key='version'"
+
+
+async def ensure_catalogue_meta(db):
+    for stmt in SCHEMA:
+        await db.execute(stmt)
+
+
+async def ensure_catalogue_identity(db):
+    """A random id for this DB, so files derived from it (snapshots) never match a reseeded or swapped DB."""
+    await db.execute("INSERT OR IGNORE INTO catalogue_meta(key, value) "
+                     "VALUES ('identity', random() & 9223372036854775807)")
+
+
+async def bump_version(db):
+    """Mark the places catalogue as changed; call inside the writing transaction."""
+    await db.execute(_BUMP)
+
+
+class CatalogueVersion:
+    """In-memory copy of the catalogue version that derived caches key on.
+
+    refresh() after a local import picks up the bump immediately; the poll
+    task catches imports made by other processes sharing the DB.
+    """
+
+    def __init__(self, pool, poll_interval: float = 5.0):
+        self.pool = pool
+        self.poll_interval = poll_interval
+        self.value = 0
+        self.identity = 0
+        self._poller = BackgroundTask(lambda: every(self.poll_interval, self.refresh, logger, "catalogue version poll"))
+
+    async def refresh(self) -> int:
+        meta = dict(await self.pool.fetchall(_SELECT))
+        self.identity = meta.get("identity", 0)
+        version = meta.get("version", 0)
+        if version != self.value:
+            logger.info("catalogue version %s -> %s", self.value, version)
+            self.value = version
+        return self.value
+
+    def start(self):
+        self._poller.start()
+
+    async def close(self):
+        await self._poller.close()
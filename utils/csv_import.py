@@ -0,0 +1,147 @@
+import asyncio
+import csv
+from itertools import islice
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional
+
+from utils import search, spatial
+from utils.catalogue import bump_version
+
+BATCH_SIZE = 5000
+
+PLACE_COLUMNS = ("city_id", "name", "category", "lat", "lon", "description", "address", "hours",
+                 "rating", "url", "kids_friendly", "dog_friendly", "price_level")
+_COLS = ", ".join(PLACE_COLUMNS)
+_PARAMS = ", ".join("?" * len(PLACE_COLUMNS))
+
+SCHEMA = (
+    # lookup key for upserts: a place is identified by (city, name)
+    "CREATE INDEX IF NOT EXISTS idx_places_city_name ON places(city_id, name)",
+)
+
+INSERT_SQL = f"INSERT INTO places({_COLS}) VALUES({_PARAMS})"
+
+# upsert goes through a per-connection staging table so each batch is three
+# set-based statements instead of a round trip per row
+_STAGE_CREATE = f"CREATE TEMP TABLE IF NOT EXISTS import_stage({_COLS})"
+_STAGE_CLEAR = "DELETE FROM import_stage"
+_STAGE_INSERT = f"INSERT INTO import_stage({_COLS}) VALUES({_PARAMS})"
+_UPSERT_UPDATE = """
+    UPDATE places SET
+        category=s.category, lat=s.lat, lon=s.lon, description=s.description, address=s.address,
+        hours=s.hours, rating=s.rating, url=s.url, kids_friendly=s.kids_friendly,
+        dog_friendly=s.dog_friendly, price_level=s.price_level
+    FROM import_stage s
+    WHERE places.id <= ? AND places.city_id=s.city_id AND places.name=s.name
+      AND (places.category, places.lat, places.lon, places.description, places.address, places.hours,
+           places.rating, places.url, places.kids_friendly, places.dog_friendly, places.price_level)
+          IS NOT (s.category, s.lat, s.lon, s.description, s.address, s.hours,
+                  s.rating, s.url, s.kids_friendly, s.dog_friendly, s.price_level)
+"""
+_UPSERT_INSERT = f"""
+    INSERT INTO places({_COLS})
+    SELECT {_COLS} FROM import_stage s
+    WHERE NOT EXISTS (SELECT 1 FROM places p WHERE p.city_id=s.city_id AND p.name=s.name)
+"""
+
+Progress = Callable[[int], Awaitable[None]]
+
+
+def as_float(x, default=0.0):
+    try: return float(str(x).strip())
+    except (TypeError, ValueError): return default
+
+
+def as_int(x, default=0):
+    try: return int(float(str(x).strip()))
+    except (TypeError, ValueError): return default
+
+
+def read_rows(path: str) -> Iterator[dict]:
+    # utf-8-sig: Google Sheets exports may start with a BOM
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        yield from csv.DictReader(f)
+
+
+def _next_chunk(rows: Iterator[dict], size: int) -> List[dict]:
+    return list(islice(rows, size))
+
+
+async def ensure_import_index(db):
+    for stmt in SCHEMA:
+        await db.execute(stmt)
+
+
+async def _city_ids(db) -> Dict[str, int]:
+    async with db.execute("SELECT name, id FROM cities") as cursor:
+        return {name: cid async for name, cid in cursor}
+
+
+async def import_csv(db, path: str, upsert: bool = True, batch_size: int = BATCH_SIZE,
+                     progress: Optional[Progress] = None) -> int:
+    """Stream a places CSV into the DB in executemany batches.
+
+    Runs inside the caller's transaction (the pool writer). With upsert=True a
+    row whose (city, name) already exists updates that place instead of
+    adding a duplicate; unchanged rows are left untouched. progress gets the
+    number of CSV rows read so far. Returns the number of places added or
+    changed.
+    """
+    if not db.in_transaction:
+        # the trigger swap below must roll back together with the rows
+        await db.execute("BEGIN")
+    cities = await _city_ids(db)
+    async with db.execute("SELECT coalesce(max(id), 0) FROM places") as cursor:
+        (max_id,) = await cursor.fetchone()
+    # per-row index triggers dominate insert cost; index the new id range in
+    # bulk at the end instead (update/delete triggers stay active)
+    for mod in (spatial, search):
+        await db.execute(f"DROP TRIGGER IF EXISTS {mod.INSERT_TRIGGER}")
+    if upsert:
+        await db.execute(_STAGE_CREATE)
+    rows = read_rows(path)
+    count = written = 0
+    while True:
+        # parsing runs off the event loop so other handlers keep being served
+        chunk = await asyncio.to_thread(_next_chunk, rows, batch_size)
+        if not chunk:
+            break
+        batch = {} if upsert else []
+        for row in chunk:
+            city = (row.get("city") or "").strip()
+            if not city: continue
+            cid = cities.get(city)
+            if cid is None:
+                cursor = await db.execute("INSERT INTO cities(name) VALUES(?)", (city,))
+                cid = cities[city] = cursor.lastrowid
+            values = (cid, row.get("name", ""), row.get("category", ""), as_float(row.get("lat")), as_float(row.get("lon")),
+                      row.get("description", ""), row.get("address", ""), row.get("hours", ""), as_float(row.get("rating", 0)),
+                      row.get("url", ""), as_int(row.get("kids_friendly", 0)), as_int(row.get("dog_friendly", 0)),
+                      as_int(row.get("price_level", 0)))
+            if upsert:
+                batch.setdefault((cid, values[1]), values)
+            else:
+                batch.append(values)
+            count += 1
+        if upsert:
+            await db.execute(_STAGE_CLEAR)
+            await db.executemany(_STAGE_INSERT, batch.values())
+            # rows added by this import aren't in the FTS index yet, so only
+            # pre-existing places may be updated; a (city, name) repeated
+            # within one file keeps its first row
+            cursor = await db.execute(_UPSERT_UPDATE, (max_id,))
+            written += cursor.rowcount
+            cursor = await db.execute(_UPSERT_INSERT)
+            written += cursor.rowcount
+        else:
+            cursor = await db.executemany(INSERT_SQL, batch)
+            written += cursor.rowcount
+        if progress:
+            await progress(count)
+    if upsert:
+        await db.execute(_STAGE_CLEAR)
+    for mod in (spatial, search):
+        await db.execute(mod.INDEX_AFTER, (max_id,))
+        for stmt in mod.SCHEMA:
+            await db.execute(stmt)
+    await bump_version(db)
+    return written
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Iterable, List, Optional
+
+import aiosqlite
+
+logger = logging.getLogger("city_guide_pro.db")
+
+# applied once per connection when the pool opens
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+class DBPool:
+    """Warm aiosqlite connections: N readers + one dedicated writer.
+
+    sqlite3 keeps a per-connection LRU of prepared statements keyed by SQL text,
+    so helpers should pass constant SQL strings to benefit from it.
+
+    With slow_query_ms set, fetchall/fetchone/execute/executemany calls taking
+    longer than that (including the wait for a connection) are logged with
+    their SQL and parameters.
+    """
+
+    def __init__(self, path: str, readers: int = 4, cached_statements: int = 256, slow_query_ms: float = 0):
+        self.path = path
+        self.slow_query_ms = slow_query_ms
+        self.readers = max(1, readers)
+        self.cached_statements = cached_statements
+        self._idle: Optional[asyncio.Queue] = None
+        self._conns: List[aiosqlite.Connection] = []
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self, read_only: bool) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path, cached_statements=self.cached_statements)
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        if read_only:
+            await conn.execute("PRAGMA query_only=ON")
+        self._conns.append(conn)
+        return conn
+
+    async def open(self):
+        if self.is_open:
+            return
+        self._write_lock = asyncio.Lock()
+        # writer first: it switches the file to WAL before readers attach
+        self._writer = await self._connect(read_only=False)
+        self._idle = asyncio.Queue()
+        for _ in range(self.readers):
+            self._idle.put_nowait(await self._connect(read_only=True))
+
+    async def close(self):
+        if not self.is_open:
+            return
+        async with self._write_lock:
+            for conn in self._conns:
+                await conn.close()
+            self._conns.clear()
+            self._writer = None
+            self._idle = None
+
+    @asynccontextmanager
+    async def read(self):
+        conn = await self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self):
+        """Serialized access to the writer; commits on success, rolls back on error."""
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            await self._writer.commit()
+
+    def _check_slow(self, started: float, sql: str, args: Any):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if self.slow_query_ms and elapsed_ms >= self.slow_query_ms:
+            logger.warning("slow query (%.1f ms): %s %r", elapsed_ms, " ".join(sql.split()), args)
+
+    async def fetchall(self, sql: str, args: Iterable[Any] = ()):
+        started = time.perf_counter()
+        async with self.read() as db:
+            rows = await db.execute_fetchall(sql, args)
+        self._check_slow(started, sql, args)
+        return rows
+
+    async def fetchone(self, sql: str, args: Iterable[Any] = ()):
+        started = time.perf_counter()
+        async with self.read() as db:
+            async with db.execute(sql, args) as cursor:
+                row = await cursor.fetchone()
+        self._check_slow(started, sql, args)
+        return row
+
+    async def execute(self, sql: str, args: Iterable[Any] = ()):
+        started = time.perf_counter()
+        async with self.write() as db:
+            await db.execute(sql, args)
+        self._check_slow(started, sql, args)
+
+    async def executemany(self, sql: str, args_seq: Iterable[Iterable[Any]]):
+        started = time.perf_counter()
+        args_seq = list(args_seq)
+        async with self.write() as db:
+            await db.executemany(sql, args_seq)
+        self._check_slow(started, sql, f"<{len(args_seq)} rows>")
@@ -0,0 +1,52 @@
+from typing import Dict, Set, Tuple
+
+from utils.write_behind import WriteBehindStore
+
+_SELECT = "SELECT place_id FROM favorites WHERE user_id=?"
+_INSERT = "INSERT OR IGNORE INTO favorites(user_id, place_id) VALUES(?,?)"
+_DELETE = "DELETE FROM favorites WHERE user_id=? AND place_id=?"
+
+
+class FavoritesStore(WriteBehindStore):
+    """Per-user favorite place ids held as in-memory sets.
+
+    contains() is a set lookup once the user's set is loaded (one indexed
+    query on a miss). add()/remove() change the set immediately and queue the
+    write; all queued writes are group-committed in a single transaction per
+    flush_interval. Queued writes are re-applied to sets loaded before they
+    were flushed, so eviction never loses a tap.
+    """
+
+    name = "favorites"
+
+    def __init__(self, pool, maxsize: int = 20000, ttl: float = 300.0, flush_interval: float = 0.5):
+        # queued writes: (user_id, place_id) -> True to add, False to remove; last tap wins
+        super().__init__(pool, maxsize, ttl, flush_interval)
+
+    async def _read(self, user_id: int) -> Set[int]:
+        return {r[0] for r in await self.pool.fetchall(_SELECT, (user_id,))}
+
+    def _merge(self, user_id: int, ids: Set[int], batch: Dict[Tuple[int, int], bool]) -> Set[int]:
+        for (uid, pid), add in batch.items():
+            if uid == user_id:
+                (ids.add if add else ids.discard)(pid)
+        return ids
+
+    async def _write(self, batch: Dict[Tuple[int, int], bool]):
+        async with self.pool.write() as db:
+            await db.executemany(_INSERT, [key for key, add in batch.items() if add])
+            await db.executemany(_DELETE, [key for key, add in batch.items() if not add])
+
+    async def ids(self, user_id: int) -> Set[int]:
+        return await self._get(user_id)
+
+    async def contains(self, user_id: int, place_id: int) -> bool:
+        return place_id in await self.ids(user_id)
+
+    async def add(self, user_id: int, place_id: int):
+        (await self.ids(user_id)).add(place_id)
+        self._dirty[(user_id, place_id)] = True
+
+    async def remove(self, user_id: int, place_id: int):
+        (await self.ids(user_id)).discard(place_id)
+        self._dirty[(user_id, place_id)] = False
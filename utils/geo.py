@@ -0,0 +1,259 @@
+import asyncio
+import importlib.util
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# imported by the first build, off the startup path; without NumPy nearby search stays on the R*Tree query
+np = None
+
+from utils.spatial import EARTH_RADIUS_KM, bounding_box
+
+logger = logging.getLogger("city_guide_pro.geo")
+
+SORT_MODES = ("distance", "rating", "blend")
+
+_SELECT = """
+    SELECT p.id, p.city_id, c.name, p.lat, p.lon, p.rating, p.kids_friendly, p.dog_friendly, p.price_level
+    FROM places p JOIN cities c ON c.id = p.city_id
+    ORDER BY p.city_id
+"""
+_FETCH_SIZE = 10000
+# distance matrix cells computed at once by a batch (points x places of one city)
+_MAX_CELLS = 1 << 21
+
+Hit = Tuple[float, int]  # (distance km, place id)
+
+
+def _import_numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+
+
+def _haversine(plat, plon, pcos, lat, lon, cos_lat):
+    """Great-circle km between radian points (column vectors) and radian places (rows)."""
+    a = np.sin((lat - plat) * 0.5) ** 2 + pcos * cos_lat * np.sin((lon - plon) * 0.5) ** 2
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GeoIndex:
+    """All places as NumPy columns grouped by city, for vectorised nearby ranking.
+
+    Each city is a contiguous slice with its bounding box, so a query only
+    touches cities its search circle overlaps and measures every place in
+    them in one array pass; top-k uses argpartition instead of a full sort.
+    Built from the catalogue snapshot when there is one (the arrays are views
+    of the shared mapping, radians precomputed) or else from the DB in the
+    background, tagged with the catalogue version like RandomIndex.
+    """
+
+    available = importlib.util.find_spec("numpy") is not None
+
+    def __init__(self, rating_weight: float = 0.5):
+        # blend score = distance / radius + rating_weight * (1 - rating / 5); lower ranks first
+        self.rating_weight = rating_weight
+        self.version: Optional[int] = None
+        self._source = None
+        self.columns: Dict[str, "np.ndarray"] = {}
+        self._cities: List[Tuple[str, int, int, float, float, float, float]] = []
+        self._rebuild: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.version is not None
+
+    def _load(self, version: int, source, columns: Dict[str, "np.ndarray"], cities):
+        lat, lon = columns["lat"], columns["lon"]
+        boxes = []
+        for name, start, end in cities:
+            if end > start:
+                boxes.append((name, start, end, float(lat[start:end].min()), float(lat[start:end].max()),
+                              float(lon[start:end].min()), float(lon[start:end].max())))
+        self.columns = columns
+        self._cities = boxes
+        self._source = source
+        self.version = version
+
+    def build_from_snapshot(self, snap):
+        _import_numpy()
+        c = snap.columns
+        columns = {name: np.frombuffer(c[name], dtype=dtype) for name, dtype in (
+            ("id", np.int64), ("lat", np.float64), ("lon", np.float64), ("rating", np.float64),
+            ("kids_friendly", np.int8), ("dog_friendly", np.int8), ("price_level", np.int8))}
+        if "lat_rad" in c:
+            for name in ("lat_rad", "lon_rad", "cos_lat"):
+                columns[name] = np.frombuffer(c[name], dtype=np.float64)
+        else:
+            # snapshot written before the radian columns existed
+            columns["lat_rad"] = np.radians(columns["lat"])
+            columns["lon_rad"] = np.radians(columns["lon"])
+            columns["cos_lat"] = np.cos(columns["lat_rad"])
+        self._load(snap.version, snap, columns, [(name, s, e) for name, (_, s, e) in snap.cities.items()])
+        logger.info("geo index mapped from snapshot v%s (%s cities)", snap.version, len(self._cities))
+
+    async def build(self, pool, version: int):
+        _import_numpy()
+        rows: list = []
+        async with pool.read() as db:
+            async with db.execute(_SELECT) as cursor:
+                while True:
+                    chunk = await cursor.fetchmany(_FETCH_SIZE)
+                    if not chunk:
+                        break
+                    rows.extend(chunk)
+        cities, start = [], 0
+        for i in range(1, len(rows) + 1):
+            if i == len(rows) or rows[i][1] != rows[start][1]:
+                cities.append((rows[start][2], start, i))
+                start = i
+        cols = list(zip(*rows)) if rows else [()] * 9
+        columns = {"id": np.array(cols[0], dtype=np.int64),
+                   "lat": np.array(cols[3], dtype=np.float64), "lon": np.array(cols[4], dtype=np.float64),
+                   "rating": np.array([r or 0.0 for r in cols[5]], dtype=np.float64)}
+        for i, name in ((6, "kids_friendly"), (7, "dog_friendly"), (8, "price_level")):
+            columns[name] = np.array([v or 0 for v in cols[i]], dtype=np.int8)
+        columns["lat_rad"] = np.radians(columns["lat"])
+        columns["lon_rad"] = np.radians(columns["lon"])
+        columns["cos_lat"] = np.cos(columns["lat_rad"])
+        self._load(version, None, columns, cities)
+        logger.info("geo index built for catalogue version %s (%s cities)", version, len(self._cities))
+
+    def refresh(self, pool, version: int, snap=None) -> Optional[asyncio.Task]:
+        """Switch to snap at once if it is for version, else rebuild from the DB in the background.
+
+        Returns the rebuild task while one is running.
+        """
+        if self.version == version and (snap is None or self._source is snap):
+            return None
+        if snap is not None and snap.version == version:
+            self.build_from_snapshot(snap)
+            return None
+        if self._rebuild is None or self._rebuild.done():
+            self._rebuild = asyncio.create_task(self.build(pool, version))
+        return self._rebuild
+
+    async def close(self):
+        """Cancel a running rebuild so it never outlives the DB pool."""
+        task, self._rebuild = self._rebuild, None
+        if task is None or task.done():
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    def _rank(self, pos, dist, k: int, sort: str, radius_km: float):
+        if sort == "rating":
+            # best rated first, nearer first among equal ratings
+            return np.lexsort((dist, -self.columns["rating"][pos]))[:k]
+        if sort == "distance":
+            key = dist
+        else:
+            key = dist / radius_km + self.rating_weight * (1.0 - self.columns["rating"][pos] / 5.0)
+        top = np.argpartition(key, k - 1)[:k] if key.size > k else np.arange(key.size)
+        return top[np.argsort(key[top], kind="stable")]
+
+    def nearest_many(self, points: Sequence[Tuple[float, float]], prefs: dict, k: int = 10,
+                     radius_km: float = 3.0, max_radius_km: Optional[float] = None,
+                     sort: str = "distance") -> List[Tuple[float, List[Hit]]]:
+        """Top-k places around each (lat, lon): [(radius used, [(distance, place id), ...]), ...].
+
+        The radius starts at radius_km and doubles, up to max_radius_km, until
+        a point has k matches. Distances for every point are computed in one
+        pass per overlapping city.
+        """
+        max_r = max(radius_km, max_radius_km or radius_km)
+        pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        boxes = np.array([bounding_box(lat, lon, max_r) for lat, lon in pts]).reshape(-1, 4)
+        plat = np.radians(pts[:, :1])
+        plon = np.radians(pts[:, 1:])
+        pcos = np.cos(plat)
+        kids, dog, price = prefs.get("kids_friendly", 0), prefs.get("dog_friendly", 0), prefs.get("price_level", 0)
+        c = self.columns
+        found: List[list] = [[] for _ in range(len(pts))]
+        for _, start, end, min_lat, max_lat, min_lon, max_lon in self._cities:
+            hit = np.flatnonzero((boxes[:, 0] <= max_lat) & (boxes[:, 1] >= min_lat)
+                                 & (boxes[:, 2] <= max_lon) & (boxes[:, 3] >= min_lon))
+            if not hit.size:
+                continue
+            # same semantics as apply_filters_clause()
+            keep = (c["kids_friendly"][start:end] >= kids) & (c["dog_friendly"][start:end] >= dog)
+            if price:
+                keep &= c["price_level"][start:end] == price
+            step = max(1, _MAX_CELLS // (end - start))
+            for i in range(0, hit.size, step):
+                chunk = hit[i:i + step]
+                d = _haversine(plat[chunk], plon[chunk], pcos[chunk], c["lat_rad"][start:end],
+                               c["lon_rad"][start:end], c["cos_lat"][start:end])
+                within = (d <= max_r) & keep
+                for row, w, p in zip(d, within, chunk):
+                    near = np.flatnonzero(w)
+                    if near.size:
+                        found[p].append((start + near, row[near]))
+        results = []
+        for parts in found:
+            if not parts:
+                results.append((max_r, []))
+                continue
+            pos = np.concatenate([p for p, _ in parts])
+            dist = np.concatenate([d for _, d in parts])
+            r = radius_km
+            while r < max_r and np.count_nonzero(dist <= r) < k:
+                r = min(max(r * 2, 0.1), max_r)
+            inside = dist <= r
+            pos, dist = pos[inside], dist[inside]
+            order = self._rank(pos, dist, k, sort, r)
+            results.append((r, [(float(dist[i]), int(c["id"][pos[i]])) for i in order]))
+        return results
+
+    def nearest(self, lat: float, lon: float, prefs: dict, **kwargs) -> Tuple[float, List[Hit]]:
+        return self.nearest_many([(lat, lon)], prefs, **kwargs)[0]
+
+
+class NearbyBatcher:
+    """Coalesces nearby lookups issued in the same event loop turn into batch calls.
+
+    When many users share their location at once (a festival crowd) the
+    queued queries with the same filters, radius and sort run as one
+    GeoIndex.nearest_many call.
+    """
+
+    def __init__(self, index: GeoIndex):
+        self.index = index
+        self._queue: Dict[tuple, List[Tuple[float, float, asyncio.Future]]] = {}
+        self._scheduled = False
+        self.batches = 0
+        self.queries = 0
+
+    def nearest(self, lat: float, lon: float, prefs: dict, k: int = 10, radius_km: float = 3.0,
+                max_radius_km: Optional[float] = None, sort: str = "distance") -> "asyncio.Future":
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = (prefs.get("kids_friendly", 0), prefs.get("dog_friendly", 0), prefs.get("price_level", 0),
+               k, radius_km, max_radius_km, sort)
+        self._queue.setdefault(key, []).append((lat, lon, future))
+        if not self._scheduled:
+            self._scheduled = True
+            loop.call_soon(self._flush)
+        return future
+
+    def _flush(self):
+        queue, self._queue = self._queue, {}
+        self._scheduled = False
+        for (kids, dog, price, k, radius_km, max_radius_km, sort), items in queue.items():
+            prefs = {"kids_friendly": kids, "dog_friendly": dog, "price_level": price}
+            try:
+                results = self.index.nearest_many([(lat, lon) for lat, lon, _ in items], prefs, k=k,
+                                                  radius_km=radius_km, max_radius_km=max_radius_km, sort=sort)
+            except Exception as e:
+                for _, _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.queries += len(items)
+            for (_, _, future), result in zip(items, results):
+                if not future.done():
+                    future.set_result(result)
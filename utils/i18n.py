@@ -0,0 +1,26 @@
+import json
+import os
+from typing import Dict, Mapping
+
+
+class Bundles:
+    """Per-language string bundles read from <directory>/<lang>.json on first use.
+
+    Keys missing from a bundle file are filled from `defaults`, so strings
+    added after a translation was shipped still resolve.
+    """
+
+    def __init__(self, directory: str, defaults: Mapping[str, Mapping[str, str]] = None):
+        self.directory = directory
+        self.defaults = defaults or {}
+        self._loaded: Dict[str, Dict[str, str]] = {}
+
+    def get(self, lang: str) -> Dict[str, str]:
+        bundle = self._loaded.get(lang)
+        if bundle is None:
+            with open(os.path.join(self.directory, f"{lang}.json"), "r", encoding="utf-8") as f:
+                bundle = json.load(f)
+            for key, value in self.defaults.get(lang, {}).items():
+                bundle.setdefault(key, value)
+            self._loaded[lang] = bundle
+        return bundle
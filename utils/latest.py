@@ -0,0 +1,51 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class LatestOnly:
+    """Runs at most one piece of work per key; newer work cancels the older one.
+
+    Meant for inline queries, where Telegram sends a query per keystroke and
+    only the answer to the last one is ever shown. When work replaces a
+    still-running predecessor it first waits `debounce` seconds, so a user
+    typing quickly costs one search instead of one per letter. Only in-flight
+    work is tracked, so the map stays as small as the current concurrency.
+    """
+
+    def __init__(self, debounce: float = 0.0):
+        self.debounce = debounce
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self.superseded = 0
+
+    async def _delayed(self, delay: float, factory: Callable[[], Awaitable[Any]]) -> Any:
+        if delay:
+            await asyncio.sleep(delay)
+        return await factory()
+
+    def cancel(self, key: Hashable):
+        """Cancel in-flight work for key, e.g. when a newer query was answered from cache."""
+        task = self._tasks.pop(key, None)
+        if task is not None and not task.done():
+            task.cancel()
+            self.superseded += 1
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Optional[Any]:
+        """Run factory() for key; returns None if newer work for key replaced it."""
+        previous = self._tasks.get(key)
+        replacing = previous is not None and not previous.done()
+        self.cancel(key)
+        task = asyncio.create_task(self._delayed(self.debounce if replacing else 0.0, factory))
+        self._tasks[key] = task
+        try:
+            # wait() rather than await: a superseded task's CancelledError must
+            # not look like the caller itself being cancelled
+            await asyncio.wait((task,))
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+        if task.cancelled():
+            return None
+        return task.result()
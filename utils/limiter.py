@@ -0,0 +1,158 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import CallbackQuery, TelegramObject
+
+
+class ConcurrencyLimiter(BaseMiddleware):
+    """Outer update middleware bounding how many handlers run at once.
+
+    Also tracks in-flight updates (including ones waiting for a slot) so
+    shutdown can drain them before the DB pool and bot session close.
+    """
+
+    def __init__(self, limit: int = 64):
+        self.limit = limit
+        self._sem = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        self.in_flight += 1
+        self._idle.clear()
+        try:
+            async with self._sem:
+                return await handler(event, data)
+        finally:
+            self.in_flight -= 1
+            if not self.in_flight:
+                self._idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        """Wait until no update is in flight; False if timeout ran out first."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class TokenBucket:
+    """rate tokens per second, up to burst; acquire() waits its turn (FIFO) for a token."""
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = time.monotonic()
+        self._not_before = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        if now < self._not_before or self._lock.locked():
+            return False
+        self._refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._not_before:
+                    await asyncio.sleep(self._not_before - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Hand out no tokens for seconds (e.g. Telegram's retry_after)."""
+        self._not_before = max(self._not_before, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    @property
+    def idle(self) -> bool:
+        """Full and nobody waiting: dropping it loses nothing."""
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.burst and not self._lock.locked() and now >= self._not_before
+
+
+class InboundThrottle(BaseMiddleware):
+    """Outer middleware shedding floods from a single user before any handler work.
+
+    Each user gets a token bucket of `rate` updates per second; updates over
+    it are dropped. A callback repeating the button still being handled, or
+    pressed again within `window` seconds, is merged into the first one
+    (filter or page buttons mashed several times act once). Dropped callbacks
+    are still answered so the button stops spinning.
+    """
+
+    def __init__(self, rate: float = 5.0, burst: float = 10.0, window: float = 1.0, max_users: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.window = window
+        self.max_users = max_users
+        self._buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        # (user_id, callback data) -> time it was accepted; None while its handler runs
+        self._taps: "OrderedDict[Tuple[int, str], Optional[float]]" = OrderedDict()
+        self.dropped: Dict[str, int] = {"rate": 0, "duplicate": 0}
+
+    def _bucket(self, user_id: int) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+            while len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+        return bucket
+
+    async def _drop(self, event: TelegramObject, reason: str):
+        self.dropped[reason] += 1
+        if isinstance(event, CallbackQuery):
+            try:
+                await event.answer()
+            except TelegramAPIError:
+                pass
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        key = None
+        if isinstance(event, CallbackQuery) and event.data:
+            key = (user.id, event.data)
+            if key in self._taps:
+                accepted = self._taps[key]
+                if accepted is None or time.monotonic() - accepted < self.window:
+                    return await self._drop(event, "duplicate")
+        if not self._bucket(user.id).try_acquire():
+            return await self._drop(event, "rate")
+        if key is None:
+            return await handler(event, data)
+        self._taps[key] = None
+        self._taps.move_to_end(key)
+        try:
+            return await handler(event, data)
+        finally:
+            self._taps[key] = time.monotonic()
+            while len(self._taps) > self.max_users:
+                self._taps.popitem(last=False)
@@ -0,0 +1,291 @@
+import asyncio
+import contextlib
+import functools
+import inspect
+import logging
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from utils.background import BackgroundTask
+
+logger = logging.getLogger("city_guide_pro.metrics")
+
+# seconds; covers cache hits (sub-ms) up to slow imports
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}"
+                                for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    """A gauge set directly, or read from `collect` (labels -> value) at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 collect: Optional[Callable[[], Dict[Labels, float]]] = None, kind: str = "gauge"):
+        super().__init__(name, help, labelnames)
+        self.kind = kind
+        self._collect = collect
+        self._values: Dict[Labels, float] = {}
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def render(self) -> List[str]:
+        values = self._collect() if self._collect else self._values
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}"
+                                for k, v in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum, count]
+        self._series: Dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Registry:
+    """Metrics rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = (),
+              collect: Optional[Callable[[], Dict[Labels, float]]] = None, kind: str = "gauge") -> Gauge:
+        return self._add(Gauge(name, help, labelnames, collect, kind))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def register_caches(self, caches: Dict[str, Callable[[], dict]]):
+        """Expose hits/misses/size/hit ratio of caches that have a stats() dict."""
+        def collect(field):
+            return lambda: {(name,): stats()[field] for name, stats in caches.items()}
+        self.gauge("city_guide_cache_hits_total", "Cache hits.", ("cache",), collect("hits"), kind="counter")
+        self.gauge("city_guide_cache_misses_total", "Cache misses.", ("cache",), collect("misses"), kind="counter")
+        self.gauge("city_guide_cache_size", "Entries held by the cache.", ("cache",), collect("size"))
+        self.gauge("city_guide_cache_hit_ratio", "Hits / lookups since start.", ("cache",), collect("hit_ratio"))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class HandlerMetrics(BaseMiddleware):
+    """Inner middleware timing each handler call and counting the ones that raise."""
+
+    def __init__(self, registry: Registry):
+        self.seconds = registry.histogram("city_guide_handler_seconds", "Handler latency.", ("handler",))
+        self.errors = registry.counter("city_guide_handler_errors_total", "Handlers that raised.", ("handler", "error"))
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        name = data["handler"].callback.__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            self.errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            self.seconds.observe(time.perf_counter() - started, name)
+
+
+class QueryTimer:
+    """Decorator factory for DB helpers: times calls and counts returned rows per query name."""
+
+    def __init__(self, registry: Registry):
+        self.seconds = registry.histogram("city_guide_db_query_seconds", "DB helper latency.", ("query",))
+        self.rows = registry.counter("city_guide_db_query_rows_total", "Rows returned by DB helpers.", ("query",))
+
+    def __call__(self, name: str):
+        def decorate(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                result = await fn(*args, **kwargs)
+                self.seconds.observe(time.perf_counter() - started, name)
+                if isinstance(result, list):
+                    self.rows.inc(name, amount=len(result))
+                elif result is not None:
+                    self.rows.inc(name)
+                return result
+            return wrapper
+        return decorate
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes a sleeping task; a busy loop delays every update."""
+
+    def __init__(self, registry: Registry, interval: float = 0.5):
+        self.interval = interval
+        self.lag = registry.gauge("city_guide_event_loop_lag_seconds", "Last measured event loop lag.")
+        self.lag_hist = registry.histogram("city_guide_event_loop_lag_sample_seconds", "Event loop lag samples.")
+        self._task = BackgroundTask(self._run)
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.lag.set(lag)
+            self.lag_hist.observe(lag)
+
+    def start(self):
+        self._task.start()
+
+    async def close(self):
+        await self._task.close()
+
+
+class Startup:
+    """Startup phase timings and the readiness flag.
+
+    Phases are timed with `with startup.phase(name):`, or measured from
+    process start with mark(name); both show up in
+    city_guide_startup_phase_seconds and in summary(). `ready` turns true
+    once the background warmup is done.
+    """
+
+    def __init__(self, registry: Registry, started: Optional[float] = None):
+        # perf_counter() at process start; the default only covers time from here on
+        self.started = time.perf_counter() if started is None else started
+        self.phases: Dict[str, float] = {}
+        self.ready = False
+        registry.gauge("city_guide_startup_phase_seconds", "Duration of each startup phase.", ("phase",),
+                       collect=lambda: {(name,): s for name, s in self.phases.items()})
+        registry.gauge("city_guide_ready", "1 once caches are warm.", collect=lambda: {(): int(self.ready)})
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - started
+
+    def mark(self, name: str) -> float:
+        self.phases[name] = elapsed = time.perf_counter() - self.started
+        return elapsed
+
+    def summary(self) -> str:
+        return ", ".join(f"{name} {s * 1000:.0f}ms" for name, s in self.phases.items())
+
+
+def ready_handler(is_ready: Callable[[], Union[bool, Awaitable[bool]]]):
+    """aiohttp handler for GET /ready: 200 once warm, 503 while warming up (for load balancer checks).
+
+    is_ready may be a coroutine function, e.g. one asking the workers behind a front process.
+    """
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        ready = is_ready()
+        if inspect.isawaitable(ready):
+            ready = await ready
+        if ready:
+            return web.Response(text="ready")
+        return web.Response(status=503, text="warming up")
+    return handle
+
+
+async def start_metrics_server(registry: Registry, host: str, port: int,
+                               is_ready: Optional[Callable[[], bool]] = None):
+    """Serve GET /metrics (and /ready); returns the aiohttp AppRunner to clean up on shutdown."""
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    if is_ready is not None:
+        app.router.add_get("/ready", ready_handler(is_ready))
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("metrics on http://%s:%s/metrics", host, port)
+    return runner
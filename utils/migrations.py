@@ -0,0 +1,109 @@
+import logging
+from typing import Awaitable, Callable, Sequence, Tuple, Union
+
+from utils.background import BackgroundTask, every
+from utils.catalogue import ensure_catalogue_identity, ensure_catalogue_meta
+from utils.csv_import import ensure_import_index
+from utils.search import add_city_column, ensure_search_index, fold_yo
+from utils.sessions import ensure_session_table
+from utils.spatial import ensure_spatial_index
+
+logger = logging.getLogger("city_guide_pro.migrations")
+
+Step = Union[str, Callable[..., Awaitable[None]]]
+
+# cap on rows sampled per index by ANALYZE; keeps it fast on large catalogues
+ANALYSIS_LIMIT = 1000
+
+
+async def analyze(db):
+    """Refresh planner statistics (sqlite_stat1) from a bounded sample."""
+    await db.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+    await db.execute("ANALYZE")
+
+
+# (user_version, description, steps); append only, never edit a shipped entry.
+# A step is SQL or an async callable taking the writer connection.
+MIGRATIONS: Sequence[Tuple[int, str, Sequence[Step]]] = (
+    (1, "spatial, search and session tables, import index, catalogue version", (
+        ensure_spatial_index,
+        ensure_search_index,
+        ensure_import_index,
+        ensure_session_table,
+        ensure_catalogue_meta,
+    )),
+    (2, "covering indexes for category lists and top rated lists", (
+        # places_by_category: city + category, ordered by rating; filter columns let
+        # SQLite reject rows from the index before touching the table
+        "CREATE INDEX IF NOT EXISTS idx_places_city_category_rating "
+        "ON places(city_id, category, rating DESC, kids_friendly, dog_friendly, price_level)",
+        # top rated / search fallback and the SQL random fallback
+        "CREATE INDEX IF NOT EXISTS idx_places_city_rating "
+        "ON places(city_id, rating DESC, kids_friendly, dog_friendly, price_level)",
+        analyze,
+    )),
+    (3, "catalogue identity, keys the snapshot files", (
+        ensure_catalogue_identity,
+    )),
+    (4, "city column in the search index, scopes MATCH to one city", (
+        add_city_column,
+    )),
+    (5, "search index folds ё to е", (
+        fold_yo,
+    )),
+)
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+async def migrate(pool) -> int:
+    """Apply pending migrations, one transaction each, tracking PRAGMA user_version."""
+    row = await pool.fetchone("PRAGMA user_version")
+    current = row[0] if row else 0
+    for version, description, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info("migration %s: %s", version, description)
+        async with pool.write() as db:
+            for step in steps:
+                if isinstance(step, str):
+                    await db.execute(step)
+                else:
+                    await step(db)
+            # user_version lives in the DB header and commits with the migration
+            await db.execute(f"PRAGMA user_version={version}")
+        current = version
+    return current
+
+
+class Optimizer:
+    """Runs PRAGMA optimize every interval so query plans follow the data as it grows.
+
+    After bulk changes (CSV imports) call analyze_soon(), which runs a
+    bounded ANALYZE in the background.
+    """
+
+    def __init__(self, pool, interval: float = 6 * 3600):
+        self.pool = pool
+        self.interval = interval
+        self._optimizer = BackgroundTask(lambda: every(self.interval, self.optimize, logger, "PRAGMA optimize"))
+        self._analyze = BackgroundTask(self._analyze_now)
+
+    async def optimize(self):
+        async with self.pool.write() as db:
+            await db.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+            await db.execute("PRAGMA optimize")
+
+    async def _analyze_now(self):
+        async with self.pool.write() as db:
+            await analyze(db)
+
+    def analyze_soon(self):
+        self._analyze.start()
+
+    def start(self):
+        self._optimizer.start()
+
+    async def close(self):
+        await self._optimizer.close()
+        await self._analyze.close()
@@ -0,0 +1,98 @@
+import logging
+import random
+import time
+from collections import OrderedDict
+from typing import Union
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, AnswerInlineQuery, TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from utils.limiter import TokenBucket
+from utils.metrics import Registry
+
+logger = logging.getLogger("city_guide_pro.outbound")
+
+# answered within seconds or never shown; not messages, so not paced
+_UNPACED = (AnswerCallbackQuery, AnswerInlineQuery)
+
+
+class SendThrottle(BaseRequestMiddleware):
+    """Bot session middleware pacing outgoing messages to Telegram's flood limits.
+
+    Every call carrying a chat_id (send, edit, ...) takes a token from a
+    global bucket (about 30 messages/s per bot) and from its chat's bucket
+    (about 1/s in private chats, 20/min in groups); callers queue FIFO for
+    tokens instead of bursting into 429s. A 429 RetryAfter pauses that
+    chat's bucket for the time Telegram asks, then the call is retried, so
+    a handler waits instead of failing.
+    """
+
+    def __init__(self, registry: Registry, global_rate: float = 30.0, chat_rate: float = 1.0,
+                 group_rate: float = 20 / 60, chat_burst: float = 3.0, max_retries: int = 3,
+                 max_wait: float = 60.0, max_chats: int = 10000):
+        self.global_bucket = TokenBucket(global_rate, burst=global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+        self.max_chats = max_chats
+        self._chats: "OrderedDict[Union[int, str], TokenBucket]" = OrderedDict()
+        self.waiting = 0
+        registry.gauge("city_guide_send_queue_depth", "Bot API calls waiting for a send token.",
+                       collect=lambda: {(): self.waiting})
+        registry.gauge("city_guide_send_chats_tracked", "Chats with a send bucket.",
+                       collect=lambda: {(): len(self._chats)})
+        self.wait_seconds = registry.histogram("city_guide_send_wait_seconds", "Time a call waited for send tokens.")
+        self.retries = registry.counter("city_guide_send_retries_total", "Calls retried after 429 RetryAfter.",
+                                        ("method",))
+        self.failed = registry.counter("city_guide_send_flood_failures_total",
+                                       "Calls given up after repeated RetryAfter.", ("method",))
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # negative ids and @channel usernames are groups/channels
+            group = isinstance(chat_id, str) or chat_id < 0
+            bucket = self._chats[chat_id] = TokenBucket(self.group_rate if group else self.chat_rate, self.chat_burst)
+            # forget chats that have been quiet long enough to refill
+            while len(self._chats) > self.max_chats:
+                oldest_id, oldest = next(iter(self._chats.items()))
+                if not oldest.idle:
+                    break
+                del self._chats[oldest_id]
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _acquire(self, chat: TokenBucket):
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            await chat.acquire()
+            await self.global_bucket.acquire()
+        finally:
+            self.waiting -= 1
+        self.wait_seconds.observe(time.monotonic() - started)
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if isinstance(method, _UNPACED) or chat_id is None:
+            return await make_request(bot, method)
+        chat = self._chat_bucket(chat_id)
+        name = type(method).__name__
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries or e.retry_after > self.max_wait:
+                    self.failed.inc(name)
+                    raise
+                self.retries.inc(name)
+                logger.warning("flood control on %s in chat %s, retrying in %ss", name, chat_id, e.retry_after)
+                # jitter so calls paused together do not come back in one burst
+                chat.pause(e.retry_after + random.uniform(0, 0.5))
@@ -0,0 +1,56 @@
+from typing import Dict, Optional, Tuple
+
+from utils.write_behind import WriteBehindStore
+
+DEFAULT_PREFS = {"lang": "ru", "kids_friendly": 0, "dog_friendly": 0, "price_level": 0}
+PREF_FIELDS = ("lang", "kids_friendly", "dog_friendly", "price_level")
+
+_SELECT = "SELECT lang, kids_friendly, dog_friendly, price_level FROM user_prefs WHERE user_id=?"
+_UPSERT = f"""
+    INSERT INTO user_prefs(user_id, {", ".join(PREF_FIELDS)}) VALUES(?, {", ".join("?" * len(PREF_FIELDS))})
+    ON CONFLICT(user_id) DO UPDATE SET {", ".join(f"{f}=excluded.{f}" for f in PREF_FIELDS)}
+"""
+
+
+class PrefsStore(WriteBehindStore):
+    """Bounded LRU/TTL cache of user_prefs rows with write-behind updates.
+
+    The cache is the source of truth for reads: a cached user costs no query.
+    Writers update the cached entry and queue the row; every queued user is
+    upserted in one executemany per flush_interval, so a tap never waits for
+    the DB writer (held for a whole CSV import). Returned dicts are shared
+    and must not be mutated by callers.
+    """
+
+    name = "prefs"
+
+    def __init__(self, pool, maxsize: int = 10000, ttl: float = 600.0, flush_interval: float = 0.5):
+        super().__init__(pool, maxsize, ttl, flush_interval)
+
+    def peek(self, user_id: int) -> Optional[dict]:
+        """Cached prefs or None; never touches the DB."""
+        return self._cached(user_id)
+
+    async def _read(self, user_id: int) -> dict:
+        row = await self.pool.fetchone(_SELECT, (user_id,))
+        # users without a row get defaults; the row is created on first write
+        return dict(zip(PREF_FIELDS, row)) if row else dict(DEFAULT_PREFS)
+
+    async def _write(self, batch: Dict[int, dict]):
+        await self.pool.executemany(_UPSERT, [(uid, *(p[f] for f in PREF_FIELDS)) for uid, p in batch.items()])
+
+    async def get(self, user_id: int) -> dict:
+        return await self._get(user_id)
+
+    async def set(self, user_id: int, field: str, value):
+        prefs = dict(await self.get(user_id))
+        prefs[field] = value
+        self._put(user_id, prefs)
+        self._dirty[user_id] = prefs
+
+    async def toggle(self, user_id: int, field: str, cycle_vals: Tuple[int, ...] = (0, 1)):
+        cur = (await self.get(user_id))[field]
+        idx = (cycle_vals.index(cur) + 1) % len(cycle_vals) if cur in cycle_vals else 0
+        nxt = cycle_vals[idx]
+        await self.set(user_id, field, nxt)
+        return nxt
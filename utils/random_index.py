@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import random
+from array import array
+from collections import OrderedDict, deque
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger("city_guide_pro.random_index")
+
+_SELECT = """
+    SELECT c.name, p.id, p.kids_friendly, p.dog_friendly, p.price_level
+    FROM places p JOIN cities c ON c.id = p.city_id
+"""
+_FETCH_SIZE = 10000
+# picks tried before accepting a recently shown place
+_AVOID_TRIES = 4
+
+Bucket = Tuple[int, int, int]  # (kids_friendly, dog_friendly, price_level)
+
+
+class RandomIndex:
+    """Per-city place ids bucketed by filter attributes for O(1) random picks.
+
+    A pick weights the buckets matching the user's filters by size (at most a
+    few dozen buckets per city) and indexes into one of them, instead of
+    ORDER BY RANDOM() over the whole city. The index is tagged with the
+    catalogue version it was built from; refresh() rebuilds it in the
+    background when the version moves on and keeps serving the old one.
+    """
+
+    def __init__(self, recent_size: int = 20, max_users: int = 10000):
+        self.version: Optional[int] = None
+        self._cities: Dict[str, Dict[Bucket, array]] = {}
+        self.recent_size = recent_size
+        self.max_users = max_users
+        self._recent: "OrderedDict[int, deque]" = OrderedDict()
+        self._rebuild: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.version is not None
+
+    async def build(self, pool, version: int):
+        cities: Dict[str, Dict[Bucket, array]] = {}
+        async with pool.read() as db:
+            async with db.execute(_SELECT) as cursor:
+                while True:
+                    rows = await cursor.fetchmany(_FETCH_SIZE)
+                    if not rows:
+                        break
+                    for city, pid, kids, dog, price in rows:
+                        buckets = cities.setdefault(city, {})
+                        key = (kids or 0, dog or 0, price or 0)
+                        ids = buckets.get(key)
+                        if ids is None:
+                            ids = buckets[key] = array("q")
+                        ids.append(pid)
+        self._cities = cities
+        self.version = version
+        logger.info("random index built for catalogue version %s (%s cities)", version, len(cities))
+
+    def refresh(self, pool, version: int) -> Optional[asyncio.Task]:
+        """Schedule a background rebuild if the index is older than version; returns the running rebuild."""
+        if self.version == version:
+            return None
+        if self._rebuild is None or self._rebuild.done():
+            self._rebuild = asyncio.create_task(self.build(pool, version))
+        return self._rebuild
+
+    async def close(self):
+        """Cancel a running rebuild so it never outlives the DB pool."""
+        task, self._rebuild = self._rebuild, None
+        if task is None or task.done():
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    def _remember(self, user_id: int, pid: int):
+        recent = self._recent.get(user_id)
+        if recent is None:
+            recent = self._recent[user_id] = deque(maxlen=self.recent_size)
+        recent.append(pid)
+        self._recent.move_to_end(user_id)
+        while len(self._recent) > self.max_users:
+            self._recent.popitem(last=False)
+
+    def pick(self, city: str, prefs: dict, user_id: Optional[int] = None) -> Optional[int]:
+        buckets = self._cities.get(city)
+        if not buckets:
+            return None
+        kids, dog, price = prefs.get("kids_friendly", 0), prefs.get("dog_friendly", 0), prefs.get("price_level", 0)
+        # same semantics as apply_filters_clause()
+        matching = [ids for (b_kids, b_dog, b_price), ids in buckets.items()
+                    if b_kids >= kids and b_dog >= dog and (not price or b_price == price)]
+        total = sum(len(ids) for ids in matching)
+        if not total:
+            return None
+        recent = self._recent.get(user_id, ()) if user_id is not None else ()
+        # in small cities only the last total-1 picks are avoided
+        window = min(len(recent), total - 1)
+        avoid = set(list(recent)[len(recent) - window:]) if window else ()
+        for _ in range(_AVOID_TRIES):
+            n = random.randrange(total)
+            for ids in matching:
+                if n < len(ids):
+                    pid = ids[n]
+                    break
+                n -= len(ids)
+            if pid not in avoid:
+                break
+        if user_id is not None:
+            self._remember(user_id, pid)
+        return pid
@@ -0,0 +1,64 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence
+
+
+class CachedResult:
+    """An ordered result list plus pages rendered from it, memoized per key."""
+
+    __slots__ = ("version", "created", "rows", "ids", "pages")
+
+    def __init__(self, version: int, rows: Sequence[tuple]):
+        self.version = version
+        self.created = time.monotonic()
+        self.rows = list(rows)
+        self.ids = [r[0] for r in self.rows]
+        # (lang, page, ...) -> rendered output
+        self.pages: Dict[Hashable, Any] = {}
+
+    def page_rows(self, page: int, page_size: int) -> List[tuple]:
+        return self.rows[page * page_size:(page + 1) * page_size]
+
+    def page_count(self, page_size: int) -> int:
+        return (len(self.rows) + page_size - 1) // page_size
+
+
+class ResultCache:
+    """Bounded LRU of CachedResult keyed on a filter tuple.
+
+    Entries built for an older catalogue version are treated as misses, so a
+    version bump invalidates everything without walking the cache. With a ttl
+    entries also expire that many seconds after they were built.
+    """
+
+    def __init__(self, maxsize: int = 2048, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, CachedResult]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, version: int) -> Optional[CachedResult]:
+        entry = self._entries.get(key)
+        if entry is None or entry.version != version or (
+                self.ttl is not None and time.monotonic() - entry.created > self.ttl):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: Hashable, version: int, rows: Sequence[tuple]) -> CachedResult:
+        entry = self._entries[key] = CachedResult(version, rows)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0}
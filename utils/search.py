@@ -0,0 +1,126 @@
+import re
+from typing import Optional
+
+_TEXT = ("name", "description", "address", "category")
+
+
+def _fold(column: str) -> str:
+    # most people type е for ё; unicode61 does not fold them, so the index and queries do
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def _folded(prefix: str = "") -> str:
+    return ", ".join(_fold(prefix + column) for column in _TEXT)
+
+
+# external-content FTS5 index over places; unicode61 folds case for Cyrillic
+# as well as Latin, prefix='2 3' makes short "typing" prefixes cheap. The
+# city column holds the place's city_id as a token, so a search ANDs it into
+# the MATCH and only ranks hits from the user's city. Text is indexed with
+# ё folded to е (the view feeds 'rebuild', the triggers everything after).
+SCHEMA = (
+    f"""CREATE VIEW IF NOT EXISTS places_fts_content AS
+        SELECT id, {", ".join(f"{_fold(c)} AS {c}" for c in _TEXT)}, city_id AS city FROM places""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS places_fts USING fts5(
+        name, description, address, category, city,
+        content='places_fts_content', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS places_fts_ai AFTER INSERT ON places BEGIN
+        INSERT INTO places_fts(rowid, name, description, address, category, city)
+        VALUES (new.id, {_folded("new.")}, new.city_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS places_fts_ad AFTER DELETE ON places BEGIN
+        INSERT INTO places_fts(places_fts, rowid, name, description, address, category, city)
+        VALUES ('delete', old.id, {_folded("old.")}, old.city_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS places_fts_au
+        AFTER UPDATE OF name, description, address, category, city_id ON places BEGIN
+        INSERT INTO places_fts(places_fts, rowid, name, description, address, category, city)
+        VALUES ('delete', old.id, {_folded("old.")}, old.city_id);
+        INSERT INTO places_fts(rowid, name, description, address, category, city)
+        VALUES (new.id, {_folded("new.")}, new.city_id);
+    END""",
+)
+
+_TRIGGERS = ("places_fts_ai", "places_fts_ad", "places_fts_au")
+INSERT_TRIGGER = "places_fts_ai"
+
+# bulk path for importers that suspend INSERT_TRIGGER
+INDEX_AFTER = f"""
+    INSERT INTO places_fts(rowid, name, description, address, category, city)
+    SELECT id, {_folded()}, city_id FROM places WHERE id > ?
+"""
+
+# bm25 column weights: name, description, address, category, city (a filter, not a signal)
+BM25_WEIGHTS = (10.0, 2.0, 1.0, 4.0, 0.0)
+# bm25() is negative (lower is better); each rating star moves a hit this much
+RATING_WEIGHT = 0.5
+RANK_EXPR = "bm25(places_fts, {}, {}, {}, {}, {}) - {} * p.rating".format(*BM25_WEIGHTS, RATING_WEIGHT)
+
+# MATCH argument scoping an fts_query() to one city, bound as (city name, fts_query);
+# an unknown city matches the nonexistent city 0
+CITY_MATCH = "'city : ' || coalesce((SELECT id FROM cities WHERE name = ?), 0) || ' AND ' || ?"
+# user terms never match the city ids
+_TEXT_COLUMNS = "{name description address category}"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+async def ensure_search_index(db):
+    """Create the FTS index and triggers; rebuild it from places when new."""
+    async with db.execute("SELECT 1 FROM sqlite_master WHERE name='places_fts'") as cursor:
+        existed = await cursor.fetchone() is not None
+    for stmt in SCHEMA:
+        await db.execute(stmt)
+    if not existed:
+        await db.execute("INSERT INTO places_fts(places_fts) VALUES('rebuild')")
+
+
+async def _recreate_search_index(db):
+    for trigger in _TRIGGERS:
+        await db.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    await db.execute("DROP TABLE IF EXISTS places_fts")
+    await db.execute("DROP VIEW IF EXISTS places_fts_content")
+    await ensure_search_index(db)
+
+
+async def add_city_column(db):
+    """Recreate an FTS index built before the city column existed."""
+    async with db.execute("SELECT 1 FROM pragma_table_info('places_fts') WHERE name='city'") as cursor:
+        if await cursor.fetchone() is not None:
+            return
+    await _recreate_search_index(db)
+
+
+async def fold_yo(db):
+    """Recreate an FTS index built before ё was folded to е."""
+    async with db.execute("SELECT sql FROM sqlite_master WHERE name='places_fts_content'") as cursor:
+        row = await cursor.fetchone()
+    if row is not None and "'ё'" in row[0]:
+        return
+    await _recreate_search_index(db)
+
+
+def _tokens(q: str):
+    return _TOKEN_RE.findall(q.lower().replace("ё", "е"))
+
+
+def fts_query(q: str) -> Optional[str]:
+    """Turn free text into an FTS5 MATCH expression: every token is a prefix term
+    on the text columns.
+
+    Returns None when the text has no searchable tokens.
+    """
+    tokens = _tokens(q)
+    if not tokens:
+        return None
+    return f"{_TEXT_COLUMNS} : (" + " ".join(f'"{tok}"*' for tok in tokens) + ")"
+
+
+def normalize_query(q: str) -> str:
+    """Canonical form of a query for cache keys: lowercased tokens (ё as е) joined by spaces.
+
+    Queries that normalize equally produce the same fts_query().
+    """
+    return " ".join(_tokens(q))
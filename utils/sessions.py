@@ -0,0 +1,56 @@
+import json
+import time
+from typing import Any, Dict
+
+from utils.write_behind import WriteBehindStore
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS user_sessions (
+        user_id INTEGER PRIMARY KEY,
+        state TEXT NOT NULL DEFAULT '{}',
+        updated_at REAL NOT NULL DEFAULT 0
+    )""",
+)
+
+_SELECT = "SELECT state FROM user_sessions WHERE user_id=?"
+_UPSERT = """
+    INSERT INTO user_sessions(user_id, state, updated_at) VALUES(?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET state=excluded.state, updated_at=excluded.updated_at
+"""
+
+
+async def ensure_session_table(db):
+    for stmt in SCHEMA:
+        await db.execute(stmt)
+
+
+class SessionStore(WriteBehindStore):
+    """Per-user session state (selected city etc.) persisted in user_sessions.
+
+    Reads hit a bounded LRU and lazily reload from the DB on a miss. Writes
+    update memory immediately and are coalesced: every dirty user is flushed
+    in one executemany per flush_interval. The TTL lets several bot
+    processes sharing one DB pick up each other's changes.
+    """
+
+    name = "session"
+
+    def __init__(self, pool, maxsize: int = 50000, ttl: float = 300.0, flush_interval: float = 0.5):
+        super().__init__(pool, maxsize, ttl, flush_interval)
+
+    async def _read(self, user_id: int) -> Dict[str, Any]:
+        row = await self.pool.fetchone(_SELECT, (user_id,))
+        return json.loads(row[0]) if row else {}
+
+    async def _write(self, batch: Dict[int, Dict[str, Any]]):
+        now = time.time()
+        await self.pool.executemany(_UPSERT, [(uid, json.dumps(state), now) for uid, state in batch.items()])
+
+    async def get(self, user_id: int, key: str, default=None):
+        return (await self._get(user_id)).get(key, default)
+
+    async def set(self, user_id: int, key: str, value):
+        state = dict(await self._get(user_id))
+        state[key] = value
+        self._put(user_id, state)
+        self._dirty[user_id] = state
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Sequence
+
+import aiohttp
+
+logger = logging.getLogger("city_guide_pro.sharding")
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_user_id(update: Dict) -> int:
+    """The user an update comes from (chat id for updates without a sender)."""
+    for key, payload in update.items():
+        if key == "update_id" or not isinstance(payload, dict):
+            continue
+        sender = payload.get("from") or payload.get("user")
+        if isinstance(sender, dict) and "id" in sender:
+            return sender["id"]
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return 0
+
+
+def shard_for(update: Dict, workers: int) -> int:
+    """Worker that owns an update: a user always lands on the same worker, so its
+    prefs, favorites and session caches stay coherent without cross-process sync.
+    CSV imports all go to worker 0, the only writer of the catalogue."""
+    message = update.get("message")
+    if isinstance(message, dict) and message.get("document"):
+        return 0
+    return abs(update_user_id(update)) % workers
+
+
+class ShardRouter:
+    """Forwards raw updates from the front process to workers over unix sockets.
+
+    Workers run the regular webhook handler, so a forwarded update is handled
+    exactly like one Telegram posted directly.
+    """
+
+    def __init__(self, socket_paths: Sequence[str], path: str, secret: str = "",
+                 retry_for: float = 30.0, retry_delay: float = 0.2):
+        self.socket_paths = list(socket_paths)
+        self.path = path
+        self.headers = {SECRET_HEADER: secret} if secret else {}
+        # long enough for a crashed worker to be restarted
+        self.retry_for = retry_for
+        self.retry_delay = retry_delay
+        self.forwarded = [0] * len(self.socket_paths)
+        self.failed = 0
+        self._sessions: List[aiohttp.ClientSession] = []
+
+    def start(self):
+        self._sessions = [aiohttp.ClientSession(connector=aiohttp.UnixConnector(path=p),
+                                                timeout=aiohttp.ClientTimeout(total=30))
+                          for p in self.socket_paths]
+
+    async def wait_ready(self, timeout: float) -> bool:
+        """Wait until every worker listens on its socket."""
+        deadline = time.monotonic() + timeout
+        while not all(os.path.exists(p) for p in self.socket_paths):
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(self.retry_delay)
+        return True
+
+    async def ready(self, timeout: float = 2.0) -> bool:
+        """True when every worker answers its GET /ready with 200 (listening and warmed up)."""
+        async def worker_ready(session: aiohttp.ClientSession) -> bool:
+            try:
+                async with session.get("http://worker/ready", timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                    return resp.status == 200
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return False
+        return bool(self._sessions) and all(await asyncio.gather(*map(worker_ready, self._sessions)))
+
+    async def forward(self, update: Dict, body: Optional[bytes] = None) -> bool:
+        """Post an update to its worker; retries while the worker is (re)starting."""
+        shard = shard_for(update, len(self._sessions))
+        session = self._sessions[shard]
+        if body is None:
+            body = json.dumps(update).encode("utf-8")
+        headers = {**self.headers, "Content-Type": "application/json"}
+        deadline = time.monotonic() + self.retry_for
+        while time.monotonic() < deadline:
+            try:
+                async with session.post(f"http://worker{self.path}", data=body, headers=headers) as resp:
+                    if resp.status == 200:
+                        self.forwarded[shard] += 1
+                        return True
+                    logger.warning("worker %s answered %s for update %s", shard, resp.status, update.get("update_id"))
+                    break
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                await asyncio.sleep(self.retry_delay)
+        self.failed += 1
+        logger.warning("update %s not delivered to worker %s", update.get("update_id"), shard)
+        return False
+
+    async def close(self):
+        for session in self._sessions:
+            await session.close()
+        self._sessions = []
@@ -0,0 +1,282 @@
+import asyncio
+import glob
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import sqlite3
+import struct
+from array import array
+from bisect import bisect_left
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger("city_guide_pro.snapshot")
+
+MAGIC = b"CGSNAP01"
+_HEADER_LEN = struct.Struct("<I")
+_ALIGN = 8
+
+# fixed-width columns: name -> array typecode
+NUMERIC = (("id", "q"), ("city_id", "i"), ("lat", "d"), ("lon", "d"), ("rating", "d"),
+           ("kids_friendly", "b"), ("dog_friendly", "b"), ("price_level", "b"),
+           # precomputed for the vectorised distance pass in utils.geo
+           ("lat_rad", "d"), ("lon_rad", "d"), ("cos_lat", "d"))
+# variable-width columns, stored as one UTF-8 blob plus an offset table each
+TEXT = ("name", "category", "description", "address", "hours", "url")
+
+_META = "SELECT key, value FROM catalogue_meta WHERE key IN ('version', 'identity')"
+_NAME = re.compile(r"catalogue-([0-9a-f]+)-(\d+)\.snap$")
+# grouped by city so a city is one contiguous range, best rated first within it
+_ROWS = """
+    SELECT id, city_id, lat, lon, rating, kids_friendly, dog_friendly, price_level,
+           name, category, description, address, hours, url
+    FROM places ORDER BY city_id, rating DESC, id
+"""
+
+
+def snapshot_path(directory: str, identity: int, version: int) -> str:
+    # the DB identity keeps a reseeded or swapped DB (whose version restarts) off older files
+    return os.path.join(directory, f"catalogue-{identity:x}-{version}.snap")
+
+
+def _read_meta(conn) -> Tuple[int, int]:
+    meta = dict(conn.execute(_META).fetchall())
+    return meta.get("identity", 0), meta.get("version", 0)
+
+
+def read_catalogue(db_path: str) -> Tuple[int, int]:
+    """(identity, version) of the catalogue in db_path."""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return _read_meta(conn)
+    finally:
+        conn.close()
+
+
+def build_snapshot(db_path: str, directory: str) -> Tuple[int, int]:
+    """Write the snapshot of the current catalogue version (blocking); returns (identity, version).
+
+    Version and rows are read in one transaction, so the file always matches
+    the identity and version in its name. Does nothing if that file already exists.
+    """
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        conn.execute("BEGIN")
+        identity, version = _read_meta(conn)
+        path = snapshot_path(directory, identity, version)
+        if os.path.exists(path):
+            return identity, version
+        cities = dict(conn.execute("SELECT id, name FROM cities"))
+        numeric = {name: array(code) for name, code in NUMERIC}
+        offsets = {name: array("Q", [0]) for name in TEXT}
+        blobs = {name: bytearray() for name in TEXT}
+        ranges: Dict[int, list] = {}
+        cursor = conn.execute(_ROWS)
+        i = 0
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                break
+            for r in rows:
+                pid, city_id = r[0], r[1]
+                numeric["id"].append(pid)
+                numeric["city_id"].append(city_id)
+                numeric["lat"].append(r[2])
+                numeric["lon"].append(r[3])
+                numeric["rating"].append(r[4] or 0.0)
+                numeric["kids_friendly"].append(r[5] or 0)
+                numeric["dog_friendly"].append(r[6] or 0)
+                numeric["price_level"].append(r[7] or 0)
+                lat_rad = math.radians(r[2])
+                numeric["lat_rad"].append(lat_rad)
+                numeric["lon_rad"].append(math.radians(r[3]))
+                numeric["cos_lat"].append(math.cos(lat_rad))
+                for name, value in zip(TEXT, r[8:]):
+                    blob = blobs[name]
+                    blob += (value or "").encode("utf-8")
+                    offsets[name].append(len(blob))
+                span = ranges.get(city_id)
+                if span is None:
+                    ranges[city_id] = [i, i + 1]
+                else:
+                    span[1] = i + 1
+                i += 1
+    finally:
+        conn.close()
+
+    # id -> row position, for primary-key lookups by binary search
+    ids = numeric["id"]
+    by_id = sorted(range(len(ids)), key=ids.__getitem__)
+    sections = dict(numeric)
+    sections["sorted_id"] = array("q", (ids[j] for j in by_id))
+    sections["sorted_pos"] = array("i", by_id)
+    for name in TEXT:
+        sections[f"{name}.offsets"] = offsets[name]
+        sections[f"{name}.blob"] = blobs[name]
+
+    layout = {}
+    position = 0
+    for name, data in sections.items():
+        nbytes = len(data) * (data.itemsize if isinstance(data, array) else 1)
+        layout[name] = [data.typecode if isinstance(data, array) else "B", position, nbytes]
+        position += -(-nbytes // _ALIGN) * _ALIGN
+    header = json.dumps({
+        "identity": identity,
+        "version": version,
+        "count": len(ids),
+        "cities": [[cid, cities.get(cid, ""), start, end] for cid, (start, end) in ranges.items()],
+        "sections": layout,
+    }).encode("utf-8")
+    base = -(-(len(MAGIC) + _HEADER_LEN.size + len(header)) // _ALIGN) * _ALIGN
+
+    os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + _HEADER_LEN.pack(len(header)) + header)
+        for name, data in sections.items():
+            f.seek(base + layout[name][1])
+            f.write(data.tobytes() if isinstance(data, array) else data)
+        f.truncate(base + position)
+    # readers only ever see complete files
+    os.replace(tmp, path)
+    logger.info("catalogue snapshot v%s: %s places, %.1f MB", version, len(ids), (base + position) / 1e6)
+    return identity, version
+
+
+class CatalogueSnapshot:
+    """Read-only, memory-mapped columnar copy of places for one catalogue version.
+
+    Every process maps the same file, so the OS page cache holds the
+    catalogue once however many workers read it. Numeric columns are
+    memoryviews over the mapping; strings are decoded on access.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self._mm.close()
+            raise ValueError(f"{path} is not a catalogue snapshot")
+        (header_len,) = _HEADER_LEN.unpack_from(self._mm, len(MAGIC))
+        start = len(MAGIC) + _HEADER_LEN.size
+        header = json.loads(self._mm[start:start + header_len])
+        base = -(-(start + header_len) // _ALIGN) * _ALIGN
+        self.path = path
+        self.identity: int = header.get("identity", 0)
+        self.version: int = header["version"]
+        self.count: int = header["count"]
+        view = memoryview(self._mm)
+        self._views = [view]
+        self.columns: Dict[str, memoryview] = {}
+        for name, (code, offset, nbytes) in header["sections"].items():
+            section = view[base + offset:base + offset + nbytes]
+            self.columns[name] = section.cast(code) if code != "B" else section
+            self._views.append(section)
+            if code != "B":
+                self._views.append(self.columns[name])
+        self.city_names: Dict[int, str] = {cid: name for cid, name, _, _ in header["cities"]}
+        # city name -> (city_id, first row, end row)
+        self.cities: Dict[str, Tuple[int, int, int]] = {name: (cid, s, e) for cid, name, s, e in header["cities"]}
+
+    def index_of(self, place_id: int) -> Optional[int]:
+        sorted_id = self.columns["sorted_id"]
+        j = bisect_left(sorted_id, place_id)
+        if j < self.count and sorted_id[j] == place_id:
+            return self.columns["sorted_pos"][j]
+        return None
+
+    def text(self, column: str, i: int) -> str:
+        offsets = self.columns[f"{column}.offsets"]
+        return bytes(self.columns[f"{column}.blob"][offsets[i]:offsets[i + 1]]).decode("utf-8")
+
+    def row(self, i: int) -> tuple:
+        """Row i shaped like the SQL place rows: id, name, category, description,
+        address, hours, rating, lat, lon, url, city, kids, dog, price."""
+        c = self.columns
+        return (c["id"][i], self.text("name", i), self.text("category", i), self.text("description", i),
+                self.text("address", i), self.text("hours", i), c["rating"][i], c["lat"][i], c["lon"][i],
+                self.text("url", i), self.city_names.get(c["city_id"][i], ""),
+                c["kids_friendly"][i], c["dog_friendly"][i], c["price_level"][i])
+
+    def place(self, place_id: int) -> Optional[tuple]:
+        i = self.index_of(place_id)
+        return self.row(i) if i is not None else None
+
+    def close(self):
+        self.columns.clear()
+        try:
+            for view in reversed(self._views):
+                view.release()
+            self._mm.close()
+        except BufferError:
+            # arrays built over the mapping (GeoIndex) still use it; it is unmapped once they are freed
+            pass
+        self._views = []
+
+
+class Snapshots:
+    """The snapshot matching the live catalogue version, swapped in as versions change.
+
+    With build=True (the front process of a sharded deployment) missing
+    versions are built in a thread; workers only map what the builder wrote
+    and fall back to SQL until the file for their version exists.
+    """
+
+    def __init__(self, directory: str, db_path: str, build: bool = False, keep: int = 2):
+        self.directory = directory
+        self.db_path = db_path
+        self.build = build
+        self.keep = keep
+        self.current: Optional[CatalogueSnapshot] = None
+        self._building: Optional[asyncio.Task] = None
+
+    def get(self, identity: int, version: int) -> Optional[CatalogueSnapshot]:
+        snap = self.current
+        if snap is not None and snap.identity == identity and snap.version == version:
+            return snap
+        path = snapshot_path(self.directory, identity, version)
+        if os.path.exists(path):
+            try:
+                fresh = CatalogueSnapshot(path)
+            except (OSError, ValueError) as e:
+                logger.warning("cannot map %s: %s", path, e)
+                return None
+            if (fresh.identity, fresh.version) != (identity, version):
+                logger.warning("%s is for catalogue %x v%s, not %x v%s", path, fresh.identity, fresh.version,
+                               identity, version)
+                fresh.close()
+                return None
+            # rows already returned are plain tuples, so the old mapping can go now
+            if snap is not None:
+                snap.close()
+            self.current = fresh
+            return fresh
+        if self.build and (self._building is None or self._building.done()):
+            self._building = asyncio.create_task(self.refresh())
+        return None
+
+    async def refresh(self) -> int:
+        """Build (if needed) and map the snapshot of the DB's current version."""
+        identity, version = await asyncio.to_thread(build_snapshot, self.db_path, self.directory)
+        self.prune(identity, version)
+        self.get(identity, version)
+        return version
+
+    def prune(self, identity: int, newest: int):
+        for path in glob.glob(os.path.join(self.directory, "catalogue-*.snap")):
+            match = _NAME.search(os.path.basename(path))
+            if match is None or int(match.group(1), 16) != identity:
+                continue
+            # workers may still map an older file for a moment; unlinking keeps their mapping valid
+            if int(match.group(2)) <= newest - self.keep:
+                os.remove(path)
+
+    async def close(self):
+        if self._building is not None:
+            await asyncio.gather(self._building, return_exceptions=True)
+            self._building = None
+        if self.current is not None:
+            self.current.close()
+            self.current = None
@@ -0,0 +1,85 @@
+import heapq
+import math
+from typing import Iterable, List, Optional, Tuple
+
+from utils.haversine import haversine_km
+
+EARTH_RADIUS_KM = 6371.0
+# R*Tree coordinates are stored as float32; pad boxes so rounding never drops a point
+_BOX_PAD_DEG = 1e-4
+
+# places_rtree mirrors places(id, lat, lon); triggers keep it in sync for every
+# insert/update/delete, including CSV imports
+SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS places_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+    """CREATE TRIGGER IF NOT EXISTS places_rtree_ai AFTER INSERT ON places BEGIN
+        INSERT OR REPLACE INTO places_rtree(id, min_lat, max_lat, min_lon, max_lon)
+        VALUES (new.id, new.lat, new.lat, new.lon, new.lon);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS places_rtree_au AFTER UPDATE OF lat, lon ON places BEGIN
+        UPDATE places_rtree SET min_lat=new.lat, max_lat=new.lat, min_lon=new.lon, max_lon=new.lon
+        WHERE id=new.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS places_rtree_ad AFTER DELETE ON places BEGIN
+        DELETE FROM places_rtree WHERE id=old.id;
+    END""",
+)
+
+INSERT_TRIGGER = "places_rtree_ai"
+
+BACKFILL = """
+    INSERT INTO places_rtree(id, min_lat, max_lat, min_lon, max_lon)
+    SELECT p.id, p.lat, p.lat, p.lon, p.lon FROM places p
+    WHERE NOT EXISTS (SELECT 1 FROM places_rtree r WHERE r.id = p.id)
+"""
+
+# bulk path for importers that suspend INSERT_TRIGGER
+INDEX_AFTER = """
+    INSERT INTO places_rtree(id, min_lat, max_lat, min_lon, max_lon)
+    SELECT id, lat, lat, lon, lon FROM places WHERE id > ?
+"""
+
+
+async def ensure_spatial_index(db):
+    """Create the R*Tree and its triggers, indexing rows that predate them."""
+    for stmt in SCHEMA:
+        await db.execute(stmt)
+    await db.execute(BACKFILL)
+
+
+def bounding_box(lat: float, lon: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """(min_lat, max_lat, min_lon, max_lon) enclosing a circle of radius_km."""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM) + _BOX_PAD_DEG
+    min_lat, max_lat = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+    cos_lat = math.cos(math.radians(lat))
+    if max_lat >= 90.0 or min_lat <= -90.0 or cos_lat < 1e-9:
+        return min_lat, max_lat, -180.0, 180.0
+    dlon = math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat)) + _BOX_PAD_DEG
+    if dlon >= 180.0:
+        return min_lat, max_lat, -180.0, 180.0
+    # a box crossing the antimeridian falls back to the full longitude range
+    min_lon, max_lon = lon - dlon, lon + dlon
+    if min_lon < -180.0 or max_lon > 180.0:
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, min_lon, max_lon
+
+
+def nearest(lat: float, lon: float, rows: Iterable[tuple], radius_km: float, limit: int,
+            lat_idx: int, lon_idx: int, sort: str = "distance", rating_idx: Optional[int] = None,
+            rating_weight: float = 0.5) -> List[tuple]:
+    """Exact-distance filter plus bounded top-k; yields (distance, *row) tuples.
+
+    sort is one of utils.geo.SORT_MODES; "rating" and "blend" need rating_idx.
+    """
+    def within():
+        for row in rows:
+            d = haversine_km(lat, lon, row[lat_idx], row[lon_idx])
+            if d <= radius_km:
+                yield (d, *row)
+    if sort == "rating":
+        key = lambda x: (-(x[rating_idx + 1] or 0.0), x[0])
+    elif sort == "blend":
+        key = lambda x: x[0] / radius_km + rating_weight * (1.0 - (x[rating_idx + 1] or 0.0) / 5.0)
+    else:
+        key = lambda x: x[0]
+    return heapq.nsmallest(limit, within(), key=key)
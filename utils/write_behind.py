@@ -0,0 +1,114 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from utils.background import BackgroundTask, every
+
+logger = logging.getLogger("city_guide_pro.write_behind")
+
+
+class WriteBehindStore:
+    """Bounded LRU/TTL cache of per-user DB state with queued, group-committed writes.
+
+    Writers change the cached value and queue the write in _dirty; a
+    background task hands everything queued to _write() in one transaction
+    per flush_interval, so a handler never waits for the DB writer. Queued
+    writes survive LRU eviction, a failed flush keeps them for the next
+    round, and a cache miss re-applies them (and the batch being committed)
+    over what it read, re-reading if a batch committed meanwhile.
+
+    Subclasses implement _read() and _write(); _merge() applies one batch of
+    queued writes to a loaded value and by default takes a queued value for
+    the same key as the new value.
+    """
+
+    name = "store"
+
+    def __init__(self, pool, maxsize: int, ttl: float, flush_interval: float):
+        self.pool = pool
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._dirty: Dict[Hashable, Any] = {}
+        # the batch being committed right now, and how many batches have been committed
+        self._flushing: Dict[Hashable, Any] = {}
+        self._flushes = 0
+        self.hits = 0
+        self.misses = 0
+        self._flusher = BackgroundTask(lambda: every(self.flush_interval, self.flush, logger, f"{self.name} flush"))
+
+    async def _read(self, key: Hashable) -> Any:
+        raise NotImplementedError
+
+    async def _write(self, batch: Dict[Hashable, Any]):
+        raise NotImplementedError
+
+    def _merge(self, key: Hashable, value: Any, batch: Dict[Hashable, Any]) -> Any:
+        return batch.get(key, value)
+
+    def _cached(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def _put(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    async def _get(self, key: Hashable) -> Any:
+        value = self._cached(key)
+        if value is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+        self.misses += 1
+        while True:
+            flushes = self._flushes
+            value = await self._read(key)
+            # a batch committed meanwhile may be missing from what we read
+            if flushes == self._flushes:
+                break
+        cached = self._cached(key)
+        if cached is not None:
+            # loaded by a concurrent call; keep the value others may already have changed
+            return cached
+        for batch in (self._flushing, self._dirty):
+            value = self._merge(key, value, batch)
+        self._put(key, value)
+        return value
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        batch = self._flushing = self._dirty
+        self._dirty = {}
+        try:
+            await self._write(batch)
+            self._flushes += 1
+        except Exception:
+            # keep newer writes that arrived during the failed flush
+            for key, value in batch.items():
+                self._dirty.setdefault(key, value)
+            raise
+        finally:
+            self._flushing = {}
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0, "pending": len(self._dirty)}
+
+    def start(self):
+        self._flusher.start()
+
+    async def close(self):
+        await self._flusher.close()
+        await self.flush()